@@ -0,0 +1,98 @@
+from rigol_ds1054z import rigol_ds1054z, npy_waveform_sink
+from rigol_sim import simulated_ds1054z
+import argparse
+import os
+import shutil
+import tempfile
+import time
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+# benchmarks the rigol_ds1054z class against the simulated scope in rigol_sim.py, no scope needed.
+#  For each operation it reports the time, the USB writes, reads and bytes, the throughput and the
+#  peak python memory (needs python 3). The simulated link has a latency per transfer and a
+#  bandwidth, set them to match your setup:
+#
+#   python bench_rigol.py --latency 0.001 --bandwidth 1e6
+#
+#  --quick stops the memory depth sweep at 6e5 points, --trace file.json instruments the scope and
+#  writes a Chrome trace of every command (this slows the benchmark down a little)
+
+parser = argparse.ArgumentParser(description='benchmark rigol_ds1054z against a simulated scope')
+parser.add_argument('--latency', type=float, default=0.001, help='seconds per USB transfer')
+parser.add_argument('--bandwidth', type=float, default=0, help='USB bytes per second, 0 is unlimited')
+parser.add_argument('--quick', action='store_true', help='only memory depths up to 6e5')
+parser.add_argument('--trace', default='', help='write a Chrome trace of the commands to this file')
+args = parser.parse_args()
+
+def run(name, function, points=None):
+	sim.reset_counters()
+	if (tracemalloc is not None):
+		tracemalloc.start()
+	start = time.time()
+	result = function()
+	elapsed = time.time() - start
+	if (tracemalloc is not None):
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		peak_text = "%8.1f" % (peak / 1e6)
+	else:
+		peak_text = "     n/a"
+	megabytes = (sim.bytes_read + sim.bytes_written) / 1e6
+	line = "%-34s %9.1f %7d %7d %9.3f %8.2f" % (name, elapsed * 1000, sim.writes, sim.reads, megabytes, megabytes / elapsed)
+	if (points is not None):
+		line += " %12.0f" % (points / elapsed)
+	else:
+		line += " %12s" % '-'
+	print (line + " " + peak_text)
+	return result
+
+sim = simulated_ds1054z(latency=args.latency, bandwidth=args.bandwidth or None)
+scope = rigol_ds1054z(transport=sim)
+if (args.trace):
+	scope.enable_instrumentation()
+output_dir = tempfile.mkdtemp(prefix='bench_rigol_')
+bandwidth_text = "%g bytes/s" % args.bandwidth if args.bandwidth else "unlimited"
+print ("Simulated link: " + str(args.latency * 1000) + " ms latency, " + bandwidth_text)
+print ("%-34s %9s %7s %7s %9s %8s %12s %8s" % ('operation', 'ms', 'writes', 'reads', 'MB', 'MB/s', 'points/s', 'peak MB'))
+
+channels = [1, 2, 3, 4]
+run('print_info', scope.print_info)
+run('single_trigger', scope.single_trigger)
+
+def measurement_per_item():
+	for channel in channels:
+		for measurement in scope.single_measurement_list:
+			scope.get_measurement(channel=channel, meas_type=measurement)
+run('get_measurement x' + str(len(channels) * len(scope.single_measurement_list)), measurement_per_item)
+run('get_measurements ' + str(len(channels)) + ' channels', lambda: scope.get_measurements(channels=channels, items=scope.single_measurement_list))
+
+memory_depths = [6e3, 6e4, 6e5, 6e6, 12e6, 24e6]
+if (args.quick):
+	memory_depths = memory_depths[:3]
+for memory_depth in memory_depths:
+	scope.setup_mem_depth(memory_depth)
+	scope.single_trigger()
+	scope.wait_for_acquisition()
+	points = int(memory_depth)
+	run('get_waveform_data BYTE %g' % memory_depth, lambda: scope.get_waveform_data(channel=1, data_format='BYTE'), points)
+	run('get_waveform_data WORD %g' % memory_depth, lambda: scope.get_waveform_data(channel=1, data_format='WORD'), points)
+	npy_filename = os.path.join(output_dir, 'waveform.npy')
+	run('stream_waveform_data npy %g' % memory_depth, lambda: scope.stream_waveform_data(npy_waveform_sink(npy_filename), channel=1), points)
+	csv_filename = os.path.join(output_dir, 'waveform.csv')
+	run('write_waveform_data csv %g' % memory_depth, lambda: scope.write_waveform_data(channel=1, filename=csv_filename))
+
+for image_format in ['PNG', 'BMP24']:
+	run('get_screen_capture ' + image_format, lambda: scope.get_screen_capture(image_format))
+run('write_screen_capture', lambda: scope.write_screen_capture(filename=os.path.join(output_dir, 'screen.png')))
+run('capture_screens x5', lambda: scope.capture_screens(5, filename_prefix=os.path.join(output_dir, 'screen_')))
+
+if (args.trace):
+	recorded = scope.disable_instrumentation()
+	recorded.write_chrome_trace(args.trace)
+	print ("")
+	print (recorded.report())
+scope.close()
+shutil.rmtree(output_dir)
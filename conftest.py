@@ -0,0 +1,2 @@
+# test_rigol.py is the demo script for a real scope (it needs smbus and a DS1054Z), not a test module
+collect_ignore = ['test_rigol.py']
@@ -0,0 +1,104 @@
+# asyncio front end for driving several DS1054Z scopes at once, needs python 3
+#
+# every scope gets its own worker thread, the blocking pyvisa calls of one scope run there in order
+# while the event loop (and the other scopes) carry on. Any rigol_ds1054z method can be awaited:
+#
+#   pool = await scope_pool.open()                 # every DS1000Z on the bus, or open(serials=[...])
+#   await pool.call('single_trigger')
+#   await pool.call('wait_for_acquisition', timeout=5)
+#   waveforms = await pool.call('get_waveform_data', channel=1)
+#   await pool.close()
+#
+# iter_waveform_chunks returns an iterator that reads from the scope while it is consumed,
+# await stream_waveform_data or get_waveform_data instead
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from rigol_ds1054z import rigol_ds1054z, find_rigol_resources, serial_number_of_resource
+
+class async_rigol_ds1054z:
+	def __init__(self, scope, executor=None):
+		self.scope = scope
+		if (executor is None):
+			executor = ThreadPoolExecutor(max_workers=1)
+		self.executor = executor
+
+	# opens the scope on its worker thread, takes the rigol_ds1054z constructor arguments
+	@classmethod
+	async def open(cls, *args, **kwargs):
+		executor = ThreadPoolExecutor(max_workers=1)
+		loop = asyncio.get_running_loop()
+		try:
+			scope = await loop.run_in_executor(executor, functools.partial(rigol_ds1054z, *args, **kwargs))
+		except BaseException:
+			executor.shutdown(wait=False)
+			raise
+		return cls(scope, executor)
+
+	# runs function(scope, *args, **kwargs) on the worker thread, for a sequence of calls in one go
+	async def run(self, function, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(function, self.scope, *args, **kwargs))
+
+	# methods of the scope become coroutines, other attributes are returned as they are
+	def __getattr__(self, name):
+		attribute = getattr(self.scope, name)
+		if (not callable(attribute)):
+			return attribute
+		async def call(*args, **kwargs):
+			loop = asyncio.get_running_loop()
+			return await loop.run_in_executor(self.executor, functools.partial(attribute, *args, **kwargs))
+		return call
+
+	async def close(self):
+		loop = asyncio.get_running_loop()
+		await loop.run_in_executor(self.executor, self.scope.close)
+		self.executor.shutdown()
+
+class scope_pool:
+	def __init__(self, scopes):
+		self.scopes = list(scopes)
+
+	# opens the scopes with the given serial numbers, or every DS1000Z found when serials is None
+	# the other arguments are passed to the rigol_ds1054z constructor of each scope
+	# the bus is enumerated once, on a worker thread, and each scope is opened by its resource string
+	# if any scope fails to open the others are closed again and the first error is raised
+	@classmethod
+	async def open(cls, serials=None, **kwargs):
+		loop = asyncio.get_running_loop()
+		resources = await loop.run_in_executor(None, find_rigol_resources)
+		if (serials is not None):
+			by_serial = dict((serial_number_of_resource(resource), resource) for resource in resources)
+			missing = [serial for serial in serials if serial not in by_serial]
+			if (missing):
+				raise ValueError("No DS1000Z scope with serial number " + ', '.join(missing) + " found")
+			resources = [by_serial[serial] for serial in serials]
+		results = await asyncio.gather(*[async_rigol_ds1054z.open(resource=resource, **kwargs) for resource in resources],
+									   return_exceptions=True)
+		scopes = [result for result in results if isinstance(result, async_rigol_ds1054z)]
+		errors = [result for result in results if not isinstance(result, async_rigol_ds1054z)]
+		if (errors):
+			await asyncio.gather(*[scope.close() for scope in scopes], return_exceptions=True)
+			raise errors[0]
+		return cls(scopes)
+
+	# calls the same method on every scope at once, returns the results in scope order
+	async def call(self, name, *args, **kwargs):
+		return await asyncio.gather(*[getattr(scope, name)(*args, **kwargs) for scope in self.scopes])
+
+	# runs coroutine_function(scope) for every scope at once, for per scope sequences like
+	# arm, wait for trigger, then read
+	async def run(self, coroutine_function):
+		return await asyncio.gather(*[coroutine_function(scope) for scope in self.scopes])
+
+	def serial_numbers(self):
+		return [serial_number_of_resource(scope.resource) for scope in self.scopes]
+
+	async def close(self):
+		await asyncio.gather(*[scope.close() for scope in self.scopes])
+
+	def __len__(self):
+		return len(self.scopes)
+
+	def __iter__(self):
+		return iter(self.scopes)
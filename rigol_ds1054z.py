@@ -1,26 +1,172 @@
-import visa
+try:
+	import visa
+except ImportError:
+	try:
+		import pyvisa as visa
+	except ImportError:
+		# pyvisa is only needed to talk to a real scope, not with a transport like rigol_sim.simulated_ds1054z
+		visa = None
 import datetime
+import hashlib
 import time
 import re
 import csv
+import io
+import json
+import logging
+import os
+import threading
+import numpy as np
 from math import floor, log10
+from contextlib import contextmanager
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+try:
+	import h5py
+except ImportError:
+	h5py = None
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+# progress messages of the class are logged here when the scope was created with debug=True
+log = logging.getLogger('rigol_ds1054z')
+
+# errors of the transport that mean the scope did not answer in time
+if (visa is not None):
+	transport_timeout_errors = (visa.VisaIOError,)
+else:
+	transport_timeout_errors = ()
+
+# replies are str in python 2 and bytes in python 3
+def reply_to_str(reply):
+	if (isinstance(reply, bytes) and not isinstance(reply, str)):
+		return reply.decode('ascii', 'replace')
+	return reply
+
+# raised when the scope does not become ready within the timeout
+class rigol_timeout_error(Exception):
+	pass
+
+# raised when the scope reports errors for commands that must not fail silently, errors holds the
+# :SYST:ERR? replies
+class rigol_scope_error(Exception):
+	def __init__(self, message, errors):
+		Exception.__init__(self, message)
+		self.errors = errors
+
+# Rigol's USB vendor id is 6833 (0x1AB1), the DS1000Z product id is 1230 (0x04CE)
+# resource strings look like USB0::6833::1230::DS1ZA192107675::0::INSTR, the fourth field is the serial number
+def find_rigol_resources(resources=None):
+	if (resources is None):
+		resources = visa.ResourceManager('@py')
+	found = []
+	for resource in resources.list_resources():
+		fields = resource.split('::')
+		if (len(fields) > 3 and fields[1].upper() in ('6833', '0X1AB1') and fields[2].upper() in ('1230', '0X04CE')):
+			found.append(resource)
+	return found
+
+def serial_number_of_resource(resource):
+	return resource.split('::')[3]
 
 class rigol_ds1054z:
 	
 	# Constructor
-	def __init__(self, debug=False):
-		resources = visa.ResourceManager('@py')
-		# insert your device here
-		# resources.list_resources() will show you the USB resource to put below
-		self.oscilloscope = resources.open_resource('USB0::6833::1230::DS1ZA192107675::0::INSTR')
+	# timeout is the default number of seconds to wait for the scope to become ready
+	# give either the visa resource string or the serial number of the scope (like DS1ZA192107675),
+	# without either the resource below is used
+	# transport replaces the visa resource with any object that has the same write, read_raw, write_raw
+	# and close methods, like rigol_sim.simulated_ds1054z
+	def __init__(self, debug=False, timeout=10.0, resource='', serial='', transport=None):
+		if (transport is not None):
+			self.oscilloscope = transport
+			resource = getattr(transport, 'resource_name', 'transport')
+		else:
+			self.oscilloscope = self.open_visa_resource(resource, serial)
+			resource = self.oscilloscope.resource_name
+		self.resource = resource
 		self.debug = debug
+		self.timeout = timeout
+		self.state_cache = {}
+		self.cache_hits = 0
+		self.cache_misses = 0
+		# background writing of screen captures
+		self.capture_writer = None
+		self.capture_threads = 2
+		self.capture_max_pending = 8
+		self.capture_count = 0
+		self.instrumentation = None
+		self.instrumented_methods = []
+
+	# progress messages, only formatted and logged with debug=True so tight loops do not wait on the console
+	def log(self, message, *args, **kwargs):
+		if (self.debug):
+			log.info(message, *args, **kwargs)
+
+	def sleep(self, seconds, command=''):
+		if (self.instrumentation is not None):
+			with self.instrumentation.span('sleep', command):
+				time.sleep(seconds)
+		else:
+			time.sleep(seconds)
+
+	# with self.timed('parse', name): records the time spent in the block when instrumented
+	def timed(self, phase, name=''):
+		if (self.instrumentation is None):
+			return null_span
+		return self.instrumentation.span(phase, name)
+
+	# records every command sent to the scope (write and read latency, bytes), parsing and sleeping,
+	# attributed to the method that was called, until disable_instrumentation. Returns the
+	# instrumentation, see its report, prometheus_text and write_chrome_trace
+	def enable_instrumentation(self, max_events=100000):
+		if (self.instrumentation is not None):
+			return self.instrumentation
+		self.instrumentation = instrumentation(max_events)
+		self.oscilloscope = instrumented_transport(self.oscilloscope, self.instrumentation)
+		for name in dir(self.__class__):
+			if (name.startswith('_') or name in ('log', 'sleep', 'timed', 'enable_instrumentation', 'disable_instrumentation')):
+				continue
+			method = getattr(self, name)
+			if (getattr(method, '__self__', None) is self):
+				setattr(self, name, self.instrumentation.wrap_method(name, method))
+				self.instrumented_methods.append(name)
+		return self.instrumentation
+
+	def disable_instrumentation(self):
+		recorded = self.instrumentation
+		if (recorded is not None):
+			for name in self.instrumented_methods:
+				delattr(self, name)
+			self.instrumented_methods = []
+			self.oscilloscope = self.oscilloscope.transport
+			self.instrumentation = None
+		return recorded
+
+	def open_visa_resource(self, resource='', serial=''):
+		resources = visa.ResourceManager('@py')
+		if (resource == '' and serial != ''):
+			matches = [found for found in find_rigol_resources(resources) if serial_number_of_resource(found) == serial]
+			if (not matches):
+				raise ValueError("No DS1000Z scope with serial number " + serial + " found")
+			resource = matches[0]
+		if (resource == ''):
+			# insert your device here
+			# resources.list_resources() will show you the USB resource to put below
+			resource = 'USB0::6833::1230::DS1ZA192107675::0::INSTR'
+		return resources.open_resource(resource)
 
 	def print_info(self):
 		self.oscilloscope.write('*IDN?')
 		fullreading = self.oscilloscope.read_raw()
 		readinglines = fullreading.splitlines()
-		print("Scope information: " + readinglines[0])
-		time.sleep(2)
+		information = reply_to_str(readinglines[0])
+		self.log("Scope information: %s", information)
+		return information
 	
 	class measurement:
 		def __init__(self, name='', description='', command='', unit='', return_type=''):
@@ -99,55 +245,168 @@ class rigol_ds1054z:
 		self.oscilloscope.write(':MEAS:ITEM? ' + meas_type.command + ',CHAN' + str(channel))
 		fullreading = self.oscilloscope.read_raw()
 		readinglines = fullreading.splitlines()
+		reading = self.convert_measurement(meas_type, readinglines[0])
+		self.print_measurement(channel, meas_type, reading)
+		return reading
+
+	def convert_measurement(self, meas_type, text):
+		if (meas_type.return_type == 'float'):
+			return float(text)
+		elif (meas_type.return_type == 'int'):
+			return int(float(text))
+		else:
+			return reply_to_str(text)
+
+	def print_measurement(self, channel, meas_type, reading):
+		if (not self.debug):
+			return
+		fields = {'channel': channel, 'measurement': meas_type.name, 'reading': reading, 'unit': meas_type.unit}
 		if (meas_type.return_type == 'float'):
-			reading = float(readinglines[0])
 			if (meas_type.unit == '%%'):
 				percentage_reading = reading*100
-				print ("Channel " + str(channel) + " " + meas_type.name + " value is %0.2F " + meas_type.unit) % percentage_reading
+				self.log("Channel %s %s value is %0.2F %%", channel, meas_type.name, percentage_reading, extra=fields)
 			else:
 				eng_reading = self.eng_notation(reading)
-				print ("Channel " + str(channel) + " " + meas_type.name + " value is " + eng_reading + " " + meas_type.unit)
+				self.log("Channel %s %s value is %s %s", channel, meas_type.name, eng_reading, meas_type.unit, extra=fields)
 		elif (meas_type.return_type == 'int'):
-			reading = int(float(readinglines[0]))
-			print ("Channel " + str(channel) + " " + meas_type.name + " value is %d " + meas_type.unit) % reading
+			self.log("Channel %s %s value is %d %s", channel, meas_type.name, reading, meas_type.unit, extra=fields)
 		else:
-			reading = str(readinglines[0])
-			print ("Channel " + str(channel) + " " + meas_type.name + " value is " + reading + " " + meas_type.unit)
-		return reading
-	
-	# if no filename is provided, the timestamp will be the filename
-	def write_screen_capture(self, filename=''):
-		self.oscilloscope.write(':DISP:DATA? ON,OFF,PNG')
-		raw_data = self.oscilloscope.read_raw()[11:] # strip off first 11 bytes
-		# save image file
+			self.log("Channel %s %s value is %s %s", channel, meas_type.name, reading, meas_type.unit, extra=fields)
+
+	# number of :MEAS:ITEM? queries joined with ';' into one transaction by get_measurements.
+	# the programming guide gives no limit, 8 is a conservative default, find_measurement_batch_size
+	# measures what your scope and firmware accept
+	measurement_batch_size = 8
+
+	# sends larger and larger batches of :MEAS:ITEM? queries until the scope stops answering every
+	# one of them (or reports an error), then uses the largest batch that worked for get_measurements
+	def find_measurement_batch_size(self, channel=1, max_batch_size=256):
+		self.check_errors()
+		working = 1
+		batch_size = 2
+		while (batch_size <= max_batch_size):
+			self.oscilloscope.write(';'.join([':MEAS:ITEM? VMAX,CHAN' + str(channel)] * batch_size))
+			try:
+				replies = self.oscilloscope.read_raw().splitlines()[0].split(b';')
+			except transport_timeout_errors:
+				self.clear_transport()
+				replies = []
+			if (len(replies) != batch_size or self.check_errors()):
+				break
+			working = batch_size
+			batch_size *= 2
+		self.measurement_batch_size = working
+		self.log("Using %d measurements per transaction", working)
+		return working
+
+	# performs many measurements with few round trips, the queries are joined with ';' and the
+	# replies come back on one line. items in double_measurement_list are measured between
+	# each pair in channel_pairs, which defaults to the first channel paired with each other one
+	# returns a dict keyed by measurement name, each holding a dict keyed by channel
+	# (or by (source1, source2) for double measurements)
+	def get_measurements(self, channels=[1], items=single_measurement_list, channel_pairs=None):
+		if (channel_pairs is None):
+			channel_pairs = [(channels[0], channel) for channel in channels[1:]]
+		if (not channel_pairs and [meas_type for meas_type in items if meas_type in self.double_measurement_list]):
+			raise ValueError("double measurements need two channels or channel_pairs")
+		queries = []
+		for meas_type in items:
+			if (meas_type in self.double_measurement_list):
+				for pair in channel_pairs:
+					queries.append((meas_type, pair, ':MEAS:ITEM? ' + meas_type.command + ',CHAN' + str(pair[0]) + ',CHAN' + str(pair[1])))
+			else:
+				for channel in channels:
+					queries.append((meas_type, channel, ':MEAS:ITEM? ' + meas_type.command + ',CHAN' + str(channel)))
+		results = {}
+		for batch_start in range(0, len(queries), self.measurement_batch_size):
+			batch = queries[batch_start:batch_start+self.measurement_batch_size]
+			self.oscilloscope.write(';'.join([query[2] for query in batch]))
+			fullreading = self.oscilloscope.read_raw()
+			with self.timed('parse', ':MEAS:ITEM?'):
+				replies = fullreading.splitlines()[0].split(b';')
+				if (len(replies) != len(batch)):
+					raise ValueError("Expected " + str(len(batch)) + " measurement replies, got " + str(len(replies)))
+				for (meas_type, source, query), text in zip(batch, replies):
+					reading = self.convert_measurement(meas_type, text)
+					results.setdefault(meas_type.name, {})[source] = reading
+					self.print_measurement(source, meas_type, reading)
+		return results
+
+	# returns the screen image as a memoryview of the reply, without copying it
+	# image_format is one of PNG, BMP8, BMP24, JPEG or TIFF
+	def get_screen_capture(self, image_format='PNG'):
+		self.oscilloscope.write(':DISP:DATA? ON,OFF,' + image_format)
+		return self.read_tmc_block()
+
+	# if no filename is provided, the timestamp (with microseconds) and a count will be the filename
+	# if the filename does not end in .png the image is converted, thumbnail_size=(width, height) also
+	# writes a small copy next to it, both need PIL
+	# with background=True the file is written on a worker thread and the call returns right after
+	# the transfer, call wait_for_captures to wait until all files are written
+	def write_screen_capture(self, filename='', background=False, thumbnail_size=None):
+		raw_data = self.get_screen_capture()
 		if (filename == ''):
-			filename = "rigol_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") +".png"
-		fid = open(filename, 'wb')
-		fid.write(raw_data)
-		fid.close()
-		print ("Wrote screen capture to filename " + '\"' + filename + '\"')
-		time.sleep(5)
-		
+			filename = "rigol_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f") + "_%04d" % self.capture_count + ".png"
+		self.capture_count += 1
+		if (background):
+			if (self.capture_writer is None):
+				self.capture_writer = background_writer(num_threads=self.capture_threads, max_pending=self.capture_max_pending)
+			self.capture_writer.submit(save_screen_capture, raw_data, filename, thumbnail_size, self.debug)
+		else:
+			save_screen_capture(raw_data, filename, thumbnail_size, self.debug)
+		return filename
+
+	# waits until the screen captures written in the background are on disk
+	def wait_for_captures(self):
+		if (self.capture_writer is not None):
+			capture_writer = self.capture_writer
+			self.capture_writer = None
+			capture_writer.close()
+
+	# takes num_captures screen captures every interval seconds and writes them in the background,
+	# if the disk falls behind by more than capture_max_pending images the captures wait for it
+	# returns the filenames once all are written
+	def capture_screens(self, num_captures, interval=0.0, filename_prefix='rigol_', extension='.png', thumbnail_size=None):
+		filenames = []
+		timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+		next_capture = time.time()
+		for capture_num in range(num_captures):
+			filename = filename_prefix + timestamp + "_%04d" % capture_num + extension
+			filenames.append(self.write_screen_capture(filename, background=True, thumbnail_size=thumbnail_size))
+			next_capture += interval
+			if (capture_num < num_captures - 1 and next_capture > time.time()):
+				self.sleep(next_capture - time.time())
+		self.wait_for_captures()
+		return filenames
+
 	def close(self):
-		self.oscilloscope.close()
-		print "Closed USB session to oscilloscope"
+		try:
+			self.wait_for_captures()
+		finally:
+			self.oscilloscope.close()
+		self.log("Closed USB session to oscilloscope")
 		
 	def reset(self):
 		self.oscilloscope.write('*RST')
-		print "Reset oscilloscope"
-		time.sleep(8)
+		self.invalidate_cache()
+		self.wait_for_complete()
+		self.log("Reset oscilloscope")
 		
 	# probe should either be 10.0 or 1.0, per the setting on the physical probe
+	# the scope rescales the vertical scale and offset when the probe ratio changes, so the probe is set
+	# first and the cached scale and offset are dropped when it changed
 	def setup_channel(self, channel=1, on=1, offset_divs=0.0, volts_per_div=1.0, probe=10.0):
 		if (on == 1):
-			self.oscilloscope.write(':CHAN' + str(channel) + ':DISP ' + 'ON')
-			self.oscilloscope.write(':CHAN' + str(channel) + ':SCAL ' + str(volts_per_div))
-			self.oscilloscope.write(':CHAN' + str(channel) + ':OFFS ' + str(offset_divs*volts_per_div))
-			self.oscilloscope.write(':CHAN' + str(channel) + ':PROB ' + str(probe))
-			print ("Turned on CH" + str(channel) + ", position is " + str(offset_divs) + " divisions from center, " + str(volts_per_div) + " volts/div, scope is " + str(probe) + "x")
+			self.set_value(':CHAN' + str(channel) + ':DISP', 'ON')
+			if (self.set_value(':CHAN' + str(channel) + ':PROB', probe)):
+				self.state_cache.pop(':CHAN' + str(channel) + ':SCAL', None)
+				self.state_cache.pop(':CHAN' + str(channel) + ':OFFS', None)
+			self.set_value(':CHAN' + str(channel) + ':SCAL', volts_per_div)
+			self.set_value(':CHAN' + str(channel) + ':OFFS', offset_divs*volts_per_div)
+			self.log("Turned on CH%s, position is %s divisions from center, %s volts/div, scope is %sx", channel, offset_divs, volts_per_div, probe)
 		else:
-			self.oscilloscope.write(':CHAN' + str(channel) + ':DISP OFF')
-			print ("Turned off channel " + str(channel))
+			self.set_value(':CHAN' + str(channel) + ':DISP', 'OFF')
+			self.log("Turned off channel %s", channel)
 	
 	def val_and_unit_to_real_val(self, val_with_unit='1s'):
 		number = int(re.search(r"([0-9]+)",val_with_unit).group(0))
@@ -167,109 +426,814 @@ class rigol_ds1054z:
 	# remember to always use lowercase time_per_div units, the regex look for lowercase
 	def setup_timebase(self, time_per_div='1ms', delay='1ms'):
 		time_per_div_real = self.val_and_unit_to_real_val(time_per_div)
-		self.oscilloscope.write(':TIM:MAIN:SCAL ' + str(time_per_div_real))
-		print ("Timebase was set to " + time_per_div + " per division")
+		self.set_value(':TIM:MAIN:SCAL', time_per_div_real)
+		self.log("Timebase was set to %s per division", time_per_div)
 		delay_real = self.val_and_unit_to_real_val(delay)
-		self.oscilloscope.write(':TIM:MAIN:OFFS ' + str(delay_real))
+		self.set_value(':TIM:MAIN:OFFS', delay_real)
 	
 	# remember to always use lowercase level units, the regex look for lowercase
 	def setup_trigger(self, channel=1, slope_pos=1, level='100mv'):
 		level_real = self.val_and_unit_to_real_val(level)
-		self.oscilloscope.write(':TRIG:EDG:SOUR CHAN' + str(channel))
+		self.set_value(':TRIG:EDG:SOUR', 'CHAN' + str(channel))
 		if (slope_pos == 0):
-			self.oscilloscope.write(':TRIG:EDG:SLOP NEG')
+			self.set_value(':TRIG:EDG:SLOP', 'NEG')
 		else:
-			self.oscilloscope.write(':TRIG:EDG:SLOP POS')
-		self.oscilloscope.write(':TRIG:EDG:LEV ' + str(level_real))
+			self.set_value(':TRIG:EDG:SLOP', 'POS')
+		self.set_value(':TRIG:EDG:LEV', level_real)
 		if (slope_pos == 1):
-			print ("Triggering on CH" + str(channel) + " positive edge with level of " + level)
+			self.log("Triggering on CH%s positive edge with level of %s", channel, level)
 		else:
-			print ("Triggering on CH" + str(channel) + " negative edge with level of " + level)
+			self.log("Triggering on CH%s negative edge with level of %s", channel, level)
 	
 	# decode channel is either 1 or 2, only two decodes can be present at any time
 	# use uppercase for encoding, valid choices are HEX, ASC, DEC, BIN, LINE
 	# position_divs is the number of division (from bottom) to position the decode
 	def setup_i2c_decode(self, decode_channel=1, on=1, sda_channel=1, scl_channel=2, encoding='HEX', position_divs=1.0):
 		if (on == 0):
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':CONF:LINE OFF')
+			self.set_value(':DEC' + str(decode_channel) + ':CONF:LINE', 'OFF')
 		else:
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':MODE IIC')
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':DISP ON')
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':FORM ' + encoding)
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':POS ' + str(400-position_divs*50))
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':THRE AUTO')
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':CONF:LINE ON')
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':IIC:CLK CHAN' + str(scl_channel))
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':IIC:DATA CHAN' + str(sda_channel))
-			self.oscilloscope.write(':DEC' + str(decode_channel) + ':IIC:ADDR RW')
-
-	def single_trigger(self):
+			self.set_value(':DEC' + str(decode_channel) + ':MODE', 'IIC')
+			self.set_value(':DEC' + str(decode_channel) + ':DISP', 'ON')
+			self.set_value(':DEC' + str(decode_channel) + ':FORM', encoding)
+			self.set_value(':DEC' + str(decode_channel) + ':POS', 400-position_divs*50)
+			self.set_value(':DEC' + str(decode_channel) + ':THRE', 'AUTO')
+			self.set_value(':DEC' + str(decode_channel) + ':CONF:LINE', 'ON')
+			self.set_value(':DEC' + str(decode_channel) + ':IIC:CLK', 'CHAN' + str(scl_channel))
+			self.set_value(':DEC' + str(decode_channel) + ':IIC:DATA', 'CHAN' + str(sda_channel))
+			self.set_value(':DEC' + str(decode_channel) + ':IIC:ADDR', 'RW')
+
+	# the setup_* methods write through a cache of the scope state keyed by SCPI path (like ':CHAN1:SCAL')
+	# and skip a write when the cached value is the same. reset and restore_scope_settings_from_file
+	# clear the cache, call resync after changing settings on the front panel
+	def set_value(self, path, value):
+		value = str(value)
+		if (path in self.state_cache and self.same_value(self.state_cache[path], value)):
+			self.cache_hits += 1
+			return False
+		self.cache_misses += 1
+		self.oscilloscope.write(path + ' ' + value)
+		self.state_cache[path] = value
+		return True
+
+	# returns the cached value of a path, or queries the scope and caches the reply
+	def get_value(self, path):
+		if (path in self.state_cache):
+			self.cache_hits += 1
+			return self.state_cache[path]
+		self.cache_misses += 1
+		value = reply_to_str(self.query(path + '?'))
+		self.state_cache[path] = value
+		return value
+
+	# the scope answers in its own format ('1' for ON, '2.000000e+00' for 2.0)
+	def same_value(self, a, b):
+		aliases = {'ON': '1', 'OFF': '0'}
+		a = aliases.get(a.upper(), a.upper())
+		b = aliases.get(b.upper(), b.upper())
+		if (a == b):
+			return True
+		try:
+			return float(a) == float(b)
+		except ValueError:
+			return False
+
+	def invalidate_cache(self):
+		self.state_cache = {}
+
+	# re-reads every cached path from the scope, for settings changed on the front panel
+	def resync(self):
+		for path in list(self.state_cache.keys()):
+			self.state_cache[path] = reply_to_str(self.query(path + '?'))
+
+	def cache_stats(self):
+		return {'hits': self.cache_hits, 'misses': self.cache_misses, 'entries': len(self.state_cache)}
+
+	# sends a query and returns the first line of the reply
+	def query(self, command):
+		self.oscilloscope.write(command)
+		return self.oscilloscope.read_raw().splitlines()[0].strip()
+
+	# after a visa timeout the scope may still answer the query, the late reply would then be read as
+	# the reply of the next query. A device clear throws it away (transports without clear have no
+	# late replies)
+	def clear_transport(self):
+		if (hasattr(self.oscilloscope, 'clear')):
+			self.oscilloscope.clear()
+
+	# repeats a query until done(reply) is true, waiting twice as long after each try up to max_delay
+	# the scope may not answer at all while busy, a visa timeout counts as not done yet and clears the
+	# session before the query is sent again. raises rigol_timeout_error if it is still not done after
+	# timeout seconds
+	def poll(self, command, done, timeout=None, initial_delay=0.01, max_delay=0.5):
+		if (timeout is None):
+			timeout = self.timeout
+		deadline = time.time() + timeout
+		delay = initial_delay
+		while True:
+			try:
+				reply = self.query(command)
+				if (done(reply)):
+					return reply
+			except transport_timeout_errors:
+				self.clear_transport()
+			if (time.time() + delay > deadline):
+				raise rigol_timeout_error(command + " not done after " + str(timeout) + " seconds")
+			self.sleep(delay, command)
+			delay = min(delay * 2, max_delay)
+
+	# returns once the scope has finished all pending commands
+	def wait_for_complete(self, timeout=None):
+		self.poll('*OPC?', lambda reply: reply == b'1', timeout)
+
+	# returns once the scope has triggered, the acquisition may still be running (TD)
+	# call wait_for_acquisition before reading the waveform data
+	def wait_for_trigger(self, timeout=None):
+		return self.poll(':TRIG:STAT?', lambda reply: reply in (b'TD', b'STOP'), timeout)
+
+	# returns once the acquisition armed by single_trigger is complete and the scope has stopped
+	# single_trigger waits until :SING is done and the scope has left STOP (or finished already),
+	# so this STOP is the new acquisition
+	def wait_for_acquisition(self, timeout=None):
+		return self.poll(':TRIG:STAT?', lambda reply: reply == b'STOP', timeout)
+
+	# reads the error queue until it is empty, logs and returns the errors
+	def check_errors(self):
+		errors = []
+		while True:
+			reply = self.query(':SYST:ERR?')
+			if (reply.startswith(b'0,')):
+				return errors
+			log.warning("Scope error: %s", reply_to_str(reply))
+			errors.append(reply)
+
+	# seconds single_trigger gives the trigger status to leave STOP after :SING. A scope that is still
+	# in STOP after that has triggered and completed the acquisition before the first poll
+	arm_settle_time = 0.05
+
+	# returns once the scope is armed (it has left STOP) or has already completed the acquisition,
+	#  call wait_for_trigger to block until it triggers and wait_for_acquisition until the data can be read
+	def single_trigger(self, timeout=None):
 		self.oscilloscope.write(':SING')
-		time.sleep(3)
+		self.wait_for_complete(timeout)
+		try:
+			self.poll(':TRIG:STAT?', lambda reply: reply != b'STOP', self.arm_settle_time, initial_delay=0.001, max_delay=0.01)
+		except rigol_timeout_error:
+			self.log("Scope stopped again right after :SING, the acquisition is complete")
 		
 	def force_trigger(self):
 		self.oscilloscope.write(':TFOR')
-		time.sleep(3)
+		self.wait_for_complete()
 		
 	def run_trigger(self):
 		self.oscilloscope.write(':RUN')
-		time.sleep(3)
+		self.wait_for_complete()
 		
 	# only allowed values are 6e3, 6e4, 6e5, 6e6, 12e6 for single channels
 	# only allowed values are 6e3, 6e4, 6e5, 6e6, 12e6 for   dual channels
 	# only allowed values are 3e3, 3e4, 3e5, 3e6, 6e6  for 3 or 4 channels
 	# the int conversion is needed for scientific notation values
 	def setup_mem_depth(self, memory_depth=12e6):
-		self.oscilloscope.write(':ACQ:MDEP ' + str(int(memory_depth)))
-		print "Acquire memory depth set to %d samples" % memory_depth
+		self.set_value(':ACQ:MDEP', int(memory_depth))
+		self.log("Acquire memory depth set to %d samples", memory_depth)
 
-	def write_waveform_data(self, channel=1, filename=''):
-		self.oscilloscope.write(':WAV:SOUR: CHAN' + str(channel))
-		time.sleep(1)
-		self.oscilloscope.write(':WAV:MODE NORM')
-		self.oscilloscope.write(':WAV:FORM ASC')
-		self.oscilloscope.write(':ACQ:MDEP?')
+	# maximum number of points the scope returns for one :WAV:DATA? in each format
+	waveform_chunk_points = {'BYTE': 250000, 'WORD': 125000, 'ASC': 15625}
+
+	# the scope prefixes binary replies with an IEEE 488.2 definite length header,
+	# '#' followed by the number of length digits, the length, then the payload
+	def read_tmc_block(self):
+		"""Read one definite length block and return the payload as a memoryview"""
 		fullreading = self.oscilloscope.read_raw()
-		readinglines = fullreading.splitlines()
-		mdepth = int(readinglines[0])
-		num_reads = (mdepth / 15625) +1
+		with self.timed('parse', 'block header'):
+			if (fullreading[0:1] != b'#'):
+				raise ValueError("Reply is not a TMC block: %r" % fullreading[0:16])
+			num_digits = int(fullreading[1:2])
+			start = 2 + num_digits
+			length = int(fullreading[2:start])
+			return memoryview(fullreading)[start:start+length]
+
+	def get_waveform_preamble(self):
+		self.oscilloscope.write(':WAV:PRE?')
+		fullreading = self.oscilloscope.read_raw()
+		with self.timed('parse', ':WAV:PRE?'):
+			fields = fullreading.splitlines()[0].split(b',')
+			return {'format':      int(fields[0]),
+					'type':        int(fields[1]),
+					'points':      int(fields[2]),
+					'count':       int(fields[3]),
+					'x_increment': float(fields[4]),
+					'x_origin':    float(fields[5]),
+					'x_reference': float(fields[6]),
+					'y_increment': float(fields[7]),
+					'y_origin':    float(fields[8]),
+					'y_reference': float(fields[9])}
+
+	# stops the scope and selects binary transfer of a channel, raw memory can only be read while stopped
+	# data_format is either BYTE (8 bit samples) or WORD (16 bit samples, twice the transfer)
+	# mode is RAW for the whole acquisition memory or NORM for the screen points
+	# returns the preamble and the numpy dtype of the samples
+	def setup_waveform_transfer(self, channel=1, data_format='BYTE', mode='RAW'):
+		data_format = data_format.upper()
+		if (data_format == 'BYTE'):
+			dtype = np.dtype('u1')
+		elif (data_format == 'WORD'):
+			dtype = np.dtype('<u2')
+		else:
+			raise ValueError("data_format must be BYTE or WORD, not " + str(data_format))
+		self.oscilloscope.write(':STOP')
+		self.set_value(':WAV:SOUR', 'CHAN' + str(channel))
+		self.set_value(':WAV:MODE', mode)
+		self.set_value(':WAV:FORM', data_format)
+		return self.get_waveform_preamble(), dtype
+
+	# start and stop are 0-based, stop is exclusive, stop-start must not exceed waveform_chunk_points
+	def read_waveform_chunk(self, start, stop, dtype):
+		# :WAV:STAR and :WAV:STOP are 1-based and inclusive
+		self.oscilloscope.write(':WAV:STAR ' + str(start + 1))
+		self.oscilloscope.write(':WAV:STOP ' + str(stop))
+		self.oscilloscope.write(':WAV:DATA?')
+		return np.frombuffer(self.read_tmc_block(), dtype=dtype)
+
+	def scale_waveform(self, raw, preamble):
+		# volts = (value - YORigin - YREFerence) x YINCrement
+		with self.timed('parse', 'scale waveform'):
+			waveform = raw.astype(np.float32)
+			waveform -= preamble['y_origin'] + preamble['y_reference']
+			waveform *= preamble['y_increment']
+			return waveform
+
+	# reads the whole acquisition memory of a channel in binary and returns it as volts
+	def get_waveform_data(self, channel=1, data_format='BYTE'):
+		preamble, dtype = self.setup_waveform_transfer(channel, data_format)
+		num_points = preamble['points']
+		chunk_points = self.waveform_chunk_points[data_format.upper()]
+		raw = np.empty(num_points, dtype=dtype)
+		for start in range(0, num_points, chunk_points):
+			stop = min(start + chunk_points, num_points)
+			raw[start:stop] = self.read_waveform_chunk(start, stop, dtype)
+		return self.scale_waveform(raw, preamble)
+
+	# returns an iterator of the acquisition memory of a channel as numpy float32 blocks of volts,
+	# each block is read and scaled when the iterator reaches it, so only one chunk is held in memory
+	# no matter the memory depth. chunk_points is limited to what the scope returns for one :WAV:DATA?
+	def iter_waveform_chunks(self, channel=1, chunk_points=None, data_format='BYTE'):
+		preamble, dtype = self.setup_waveform_transfer(channel, data_format)
+		return self.read_waveform_chunks(preamble, dtype, chunk_points, data_format)
+
+	def read_waveform_chunks(self, preamble, dtype, chunk_points=None, data_format='BYTE'):
+		num_points = preamble['points']
+		max_chunk_points = self.waveform_chunk_points[data_format.upper()]
+		if (chunk_points is None or chunk_points > max_chunk_points):
+			chunk_points = max_chunk_points
+		chunk_points = int(chunk_points)
+		for start in range(0, num_points, chunk_points):
+			stop = min(start + chunk_points, num_points)
+			yield self.scale_waveform(self.read_waveform_chunk(start, stop, dtype), preamble)
+
+	# streams the acquisition memory of a channel into a sink (npy_waveform_sink, csv_waveform_sink,
+	# hdf5_waveform_sink or any object with open, write and close). The sink is written on a
+	# background thread so each disk write overlaps the next USB read, at most max_pending chunks are queued
+	def stream_waveform_data(self, sink, channel=1, chunk_points=None, data_format='BYTE', max_pending=2):
+		preamble, dtype = self.setup_waveform_transfer(channel, data_format)
+		sink.open(preamble['points'], preamble)
+		try:
+			writer = background_writer(num_threads=1, max_pending=max_pending)
+			try:
+				for chunk in self.read_waveform_chunks(preamble, dtype, chunk_points, data_format):
+					writer.submit(sink.write, chunk)
+			finally:
+				writer.close()
+		finally:
+			sink.close()
+		self.log("Streamed %d samples of channel %s to %s", preamble['points'], channel, sink)
+
+	# arms the scope, waits until the acquisition is complete (see single_trigger and wait_for_acquisition,
+	# trigger_timeout applies to both) and reads the channels into a capture_ring, over and over,
+	# for hunting intermittent faults. The transfer is set up and the preambles read once per session,
+	# each capture is read into preallocated buffers and scaled in place into its ring slot.
+	# runs for num_captures triggers (forever when None, stop it with Ctrl-C)
+	# mode is NORM (screen points, fastest) or RAW (whole acquisition memory)
+	# after each capture callback(ring, capture_num) is called and capture_num is put on capture_queue,
+	# the slot of a capture is reused depth captures later. Triggers that time out are counted as missed,
+	# captures that do not fit in a full capture_queue are counted as dropped
+	def acquire_continuous(self, channels=[1], num_captures=None, depth=16, mode='NORM', data_format='BYTE',
+						   trigger_timeout=None, callback=None, capture_queue=None):
+		preambles = []
+		for channel in channels:
+			preamble, dtype = self.setup_waveform_transfer(channel, data_format, mode)
+			preambles.append(preamble)
+		num_points = preambles[0]['points']
+		chunk_points = self.waveform_chunk_points[data_format.upper()]
+		ring = capture_ring(depth, channels, num_points)
+		raw = np.empty(num_points, dtype=dtype)
+		offsets = [preamble['y_origin'] + preamble['y_reference'] for preamble in preambles]
+		increments = [preamble['y_increment'] for preamble in preambles]
+		ring.start()
+		try:
+			while (num_captures is None or ring.count < num_captures):
+				try:
+					self.single_trigger(trigger_timeout)
+					self.wait_for_acquisition(trigger_timeout)
+				except rigol_timeout_error:
+					ring.missed += 1
+					continue
+				slot = ring.next_slot()
+				for channel_num in range(len(channels)):
+					self.set_value(':WAV:SOUR', 'CHAN' + str(channels[channel_num]))
+					for start in range(0, num_points, chunk_points):
+						stop = min(start + chunk_points, num_points)
+						raw[start:stop] = self.read_waveform_chunk(start, stop, dtype)
+					with self.timed('parse', 'scale waveform'):
+						np.subtract(raw, offsets[channel_num], out=slot[channel_num], casting='unsafe')
+						slot[channel_num] *= increments[channel_num]
+				capture_num = ring.commit()
+				if (callback is not None):
+					callback(ring, capture_num)
+				if (capture_queue is not None):
+					try:
+						capture_queue.put_nowait(capture_num)
+					except queue.Full:
+						ring.dropped += 1
+		except KeyboardInterrupt:
+			pass
+		ring.stop()
+		self.log("Captured %d triggers at %0.2F per second, %d missed, %d dropped", ring.count, ring.rate(), ring.missed, ring.dropped)
+		return ring
+
+	# writes the whole acquisition memory of a channel to a CSV file, one value in volts per line
+	# the memory is read once in binary chunks and written while the next chunk is read
+	def write_waveform_data(self, channel=1, filename=''):
 		if (filename == ''):
 			filename = "rigol_waveform_data_channel_" + str(channel) + "_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") +".csv"
-		fid = open(filename, 'wb')
-		print ("Started saving waveform data for channel " + str(channel) + " " + str(mdepth) + " samples to filename " + '\"' + filename + '\"')
-		for read_loop in range(0,num_reads):
-			self.oscilloscope.write(':WAV:DATA?')
-			fullreading = self.oscilloscope.read_raw()
-			readinglines = fullreading.splitlines()
-			reading = str(readinglines[0])
-			reading = reading.replace(",", "\n")
-			fid.write(reading)
-		fid.close()
+		self.log("Started saving waveform data for channel %s to filename \"%s\"", channel, filename)
+		self.stream_waveform_data(csv_waveform_sink(filename), channel=channel)
 
-	def write_scope_settings_to_file(self, filename=''):
+	# returns the scope settings (the contents of a .stp file) as bytes
+	def get_scope_settings(self):
 		self.oscilloscope.write(':SYST:SET?')
-		raw_data = self.oscilloscope.read_raw()[11:] # strip off first 11 bytes
-		
+		return self.read_tmc_block().tobytes()
+
+	# sends settings from get_scope_settings in one definite length block and waits until they are applied
+	# raises rigol_scope_error if the scope rejected them, the state cache is left empty either way
+	def set_scope_settings(self, data):
+		header = (':SYST:SET #9%09d' % len(data)).encode('ascii')
+		self.oscilloscope.write_raw(header + data + b'\n')
+		self.invalidate_cache()
+		self.wait_for_complete()
+		errors = self.check_errors()
+		if (errors):
+			raise rigol_scope_error("Scope rejected the settings: " + reply_to_str(errors[0]), errors)
+
+	def write_scope_settings_to_file(self, filename=''):
+		raw_data = self.get_scope_settings()
 		if (filename == ''):
 			filename = "rigol_settings_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") +".stp"
 		fid = open(filename, 'wb')
 		fid.write(raw_data)
 		fid.close()
-		print ("Wrote oscilloscope settings to filename " + '\"' + filename + '\"')
-		time.sleep(5)
+		self.log("Wrote oscilloscope settings to filename \"%s\"", filename)
 		
 	def restore_scope_settings_from_file(self, filename=''):
 		if (filename == ''):
-			print "ERROR: must specify filename\n"
+			log.error("ERROR: must specify filename")
 		else:
 			with open(filename, mode='rb') as file: # b is important -> binary
-				fileContent = file.read()
-				valList = list()
-				#alter ending to append new CRLF
-				fileContent = fileContent + chr(13) + chr(10)
-				#convert to a list that write_binary_values can iterate
-				for x in range(0,len(fileContent)-1):
-					valList.append(ord(fileContent[x]))
-				self.oscilloscope.write_binary_values(':SYST:SET ', valList, datatype='B', is_big_endian=True) 
-			print ("Wrote oscilloscope settings to scope")
-			time.sleep(8)
+				self.set_scope_settings(file.read())
+			self.log("Wrote oscilloscope settings to scope")
+
+	# saves the current settings as a preset in a preset_store, together with the settings the
+	# state cache knows, which load_preset uses to switch between presets with a few commands
+	def save_preset(self, name, store):
+		settings_hash = store.save(name, self.get_scope_settings(), self.state_cache)
+		self.log("Saved preset %s (%s)", name, settings_hash)
+		return settings_hash
+
+	# loads a preset from a preset_store, doing as little as possible:
+	#   'unchanged' the scope already has these settings, nothing is sent
+	#   'partial'   the scope has the settings of another preset in the store, only the cached settings
+	#               that differ are sent and the result is checked against the preset
+	#   'full'      the whole settings block is sent, the state cache is left empty since the scope
+	#               may not have taken every setting the way it was saved
+	# returns which of these it did, raises rigol_scope_error if the scope rejected the settings
+	def load_preset(self, name, store, allow_partial=True):
+		data, state = store.load(name)
+		target_hash = settings_hash(data)
+		current_hash = settings_hash(self.get_scope_settings())
+		if (current_hash == target_hash):
+			self.state_cache.update(state)
+			self.log("Preset %s is already loaded", name)
+			return 'unchanged'
+		current_state = store.state_of(current_hash)
+		if (allow_partial and state and current_state is not None and set(current_state) >= set(state)):
+			self.state_cache = dict(current_state)
+			for path in sorted(state):
+				self.set_value(path, state[path])
+			self.wait_for_complete()
+			if (settings_hash(self.get_scope_settings()) == target_hash):
+				self.log("Loaded preset %s with the differing commands", name)
+				return 'partial'
+		self.set_scope_settings(data)
+		self.log("Loaded preset %s", name)
+		return 'full'
+
+
+def settings_hash(data):
+	return hashlib.sha1(data).hexdigest()
+
+# scope settings stored on disk by content: every settings block is written once to
+# objects/<sha1>.stp in the directory, presets.json maps preset names to a block and the
+# settings the state cache knew when it was saved
+class preset_store:
+	def __init__(self, directory='~/.rigol_presets'):
+		self.directory = os.path.expanduser(directory)
+		self.objects_directory = os.path.join(self.directory, 'objects')
+		if (not os.path.isdir(self.objects_directory)):
+			os.makedirs(self.objects_directory)
+		self.index_filename = os.path.join(self.directory, 'presets.json')
+		if (os.path.exists(self.index_filename)):
+			with open(self.index_filename) as fid:
+				self.presets = json.load(fid)
+		else:
+			self.presets = {}
+
+	def object_filename(self, data_hash):
+		return os.path.join(self.objects_directory, data_hash + '.stp')
+
+	# stores a settings block if it is not there yet, returns its hash
+	def put(self, data):
+		data_hash = settings_hash(data)
+		filename = self.object_filename(data_hash)
+		if (not os.path.exists(filename)):
+			fid = open(filename + '.tmp', 'wb')
+			fid.write(data)
+			fid.close()
+			os.rename(filename + '.tmp', filename)
+		return data_hash
+
+	def get(self, data_hash):
+		with open(self.object_filename(data_hash), 'rb') as fid:
+			return fid.read()
+
+	def save(self, name, data, state=None):
+		data_hash = self.put(data)
+		self.presets[name] = {'hash': data_hash, 'state': dict(state or {})}
+		self.write_index()
+		return data_hash
+
+	# returns the settings block and the cached settings of a preset
+	def load(self, name):
+		preset = self.presets[name]
+		return self.get(preset['hash']), preset['state']
+
+	# the cached settings saved with a settings block, None when no preset has that block
+	def state_of(self, data_hash):
+		for name in sorted(self.presets):
+			if (self.presets[name]['hash'] == data_hash and self.presets[name]['state']):
+				return self.presets[name]['state']
+		return None
+
+	def names(self):
+		return sorted(self.presets)
+
+	# removes a preset, the settings block stays for other presets using it
+	def delete(self, name):
+		del self.presets[name]
+		self.write_index()
+
+	def write_index(self):
+		with open(self.index_filename + '.tmp', 'w') as fid:
+			json.dump(self.presets, fid, indent=1, sort_keys=True)
+		if (os.path.exists(self.index_filename)):
+			os.remove(self.index_filename)
+		os.rename(self.index_filename + '.tmp', self.index_filename)
+
+# runs jobs on worker threads fed through a bounded queue, submit blocks while the queue is full
+# with a single thread the jobs run in the order they were submitted
+class background_writer:
+	def __init__(self, num_threads=1, max_pending=2):
+		self.jobs = queue.Queue(maxsize=max_pending)
+		self.errors = []
+		self.threads = []
+		for thread_num in range(num_threads):
+			thread = threading.Thread(target=self.run)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def submit(self, function, *args):
+		if (self.errors):
+			raise self.errors[0]
+		self.jobs.put((function, args))
+
+	def run(self):
+		while True:
+			job = self.jobs.get()
+			try:
+				if (job is None):
+					return
+				function, args = job
+				function(*args)
+			except Exception as e:
+				self.errors.append(e)
+			finally:
+				self.jobs.task_done()
+
+	# waits for all submitted jobs, then stops the threads and raises the first job error
+	def close(self):
+		for thread in self.threads:
+			self.jobs.put(None)
+		for thread in self.threads:
+			thread.join()
+		if (self.errors):
+			raise self.errors[0]
+
+# timings collected by rigol_ds1054z.enable_instrumentation. Every record has a phase (method for a call
+# from outside, call for one method calling another, write, read, parse or sleep), the scope method
+# (the outermost one for write, read, parse and sleep), a name (the SCPI command for writes and reads),
+# start, duration and bytes. They are summed into histograms per method and phase, and the
+# first max_events are kept for the trace
+class instrumentation:
+	histogram_bounds = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+	def __init__(self, max_events=100000):
+		self.max_events = max_events
+		self.clock = getattr(time, 'perf_counter', time.time)
+		self.start_time = self.clock()
+		self.local = threading.local()
+		self.events = []
+		self.histograms = {}
+
+	# the instrumented methods running on the calling thread, outermost first
+	def method_stack(self):
+		if (not hasattr(self.local, 'method_stack')):
+			self.local.method_stack = []
+		return self.local.method_stack
+
+	def current_method(self):
+		method_stack = self.method_stack()
+		if (method_stack):
+			return method_stack[0]
+		return 'direct'
+
+	def record(self, phase, name, start, duration, num_bytes=0, method=None):
+		if (method is None):
+			method = self.current_method()
+		key = (method, phase)
+		if (key not in self.histograms):
+			self.histograms[key] = {'buckets': [0] * (len(self.histogram_bounds) + 1), 'count': 0, 'sum': 0.0, 'bytes': 0}
+		histogram = self.histograms[key]
+		bucket = 0
+		while (bucket < len(self.histogram_bounds) and duration > self.histogram_bounds[bucket]):
+			bucket += 1
+		histogram['buckets'][bucket] += 1
+		histogram['count'] += 1
+		histogram['sum'] += duration
+		histogram['bytes'] += num_bytes
+		if (len(self.events) < self.max_events):
+			self.events.append((phase, method, name, start - self.start_time, duration, num_bytes, threading.current_thread().ident))
+
+	@contextmanager
+	def span(self, phase, name='', num_bytes=0):
+		start = self.clock()
+		try:
+			yield
+		finally:
+			self.record(phase, name, start, self.clock() - start, num_bytes)
+
+	def wrap_method(self, name, method):
+		def instrumented_method(*args, **kwargs):
+			method_stack = self.method_stack()
+			outermost = not method_stack
+			method_stack.append(name)
+			start = self.clock()
+			try:
+				return method(*args, **kwargs)
+			finally:
+				method_stack.pop()
+				if (outermost):
+					self.record('method', name, start, self.clock() - start, method=name)
+				else:
+					self.record('call', name, start, self.clock() - start, method=name)
+		return instrumented_method
+
+	# one line per method and phase: count, total and mean time, bytes
+	def report(self):
+		lines = ["%-28s %-7s %7s %10s %10s %12s" % ('method', 'phase', 'count', 'total ms', 'mean ms', 'bytes')]
+		for method, phase in sorted(self.histograms):
+			histogram = self.histograms[(method, phase)]
+			lines.append("%-28s %-7s %7d %10.2f %10.3f %12d" % (method, phase, histogram['count'], histogram['sum'] * 1000,
+																 histogram['sum'] * 1000 / histogram['count'], histogram['bytes']))
+		return '\n'.join(lines)
+
+	# histograms in the Prometheus text exposition format
+	def prometheus_text(self):
+		lines = ['# HELP rigol_seconds Time spent per scope method and phase',
+				 '# TYPE rigol_seconds histogram']
+		for method, phase in sorted(self.histograms):
+			histogram = self.histograms[(method, phase)]
+			labels = 'method="%s",phase="%s"' % (method, phase)
+			cumulative = 0
+			for bound, count in zip(self.histogram_bounds, histogram['buckets']):
+				cumulative += count
+				lines.append('rigol_seconds_bucket{%s,le="%g"} %d' % (labels, bound, cumulative))
+			lines.append('rigol_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram['count']))
+			lines.append('rigol_seconds_sum{%s} %.9f' % (labels, histogram['sum']))
+			lines.append('rigol_seconds_count{%s} %d' % (labels, histogram['count']))
+		lines.append('# HELP rigol_bytes_total Bytes sent and received per scope method and phase')
+		lines.append('# TYPE rigol_bytes_total counter')
+		for method, phase in sorted(self.histograms):
+			if (phase in ('write', 'read')):
+				lines.append('rigol_bytes_total{method="%s",phase="%s"} %d' % (method, phase, self.histograms[(method, phase)]['bytes']))
+		return '\n'.join(lines) + '\n'
+
+	# the events in the Chrome trace event format, open the file in chrome://tracing or Perfetto
+	def chrome_trace(self):
+		trace_events = []
+		for phase, method, name, start, duration, num_bytes, thread in self.events:
+			trace_events.append({'name': name or phase, 'cat': phase, 'ph': 'X', 'pid': 1, 'tid': thread,
+								 'ts': start * 1e6, 'dur': duration * 1e6, 'args': {'method': method, 'bytes': num_bytes}})
+		return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+	def write_chrome_trace(self, filename):
+		fid = open(filename, 'w')
+		json.dump(self.chrome_trace(), fid)
+		fid.close()
+
+# wraps the visa resource (or another transport) and records each write and read in an instrumentation,
+# reads are named after the last query written
+class instrumented_transport:
+	def __init__(self, transport, instrumentation):
+		self.transport = transport
+		self.instrumentation = instrumentation
+		self.last_command = ''
+
+	def write(self, message):
+		self.last_command = message
+		with self.instrumentation.span('write', message, len(message) + 1):
+			return self.transport.write(message)
+
+	def read_raw(self, *args, **kwargs):
+		start = self.instrumentation.clock()
+		reply = self.transport.read_raw(*args, **kwargs)
+		self.instrumentation.record('read', self.last_command, start, self.instrumentation.clock() - start, len(reply))
+		return reply
+
+	def write_raw(self, message):
+		name = bytes(message[:16]).split(b' ')[0].decode('ascii', 'replace')
+		self.last_command = name
+		with self.instrumentation.span('write', name, len(message)):
+			return self.transport.write_raw(message)
+
+	def write_binary_values(self, message, values, *args, **kwargs):
+		self.last_command = message
+		with self.instrumentation.span('write', message, len(message) + len(values)):
+			return self.transport.write_binary_values(message, values, *args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self.transport, name)
+
+# stands in for an instrumentation span when the scope is not instrumented
+class null_span_context:
+	def __enter__(self):
+		return self
+	def __exit__(self, *exc_info):
+		return False
+
+null_span = null_span_context()
+
+# the last depth captures of acquire_continuous, data[slot, channel, point] in volts
+# capture n of the session is in slot n % depth, its trigger time in timestamps[slot]
+class capture_ring:
+	def __init__(self, depth, channels, num_points):
+		self.depth = depth
+		self.channels = list(channels)
+		self.data = np.zeros((depth, len(self.channels), num_points), dtype=np.float32)
+		self.timestamps = np.zeros(depth)
+		self.count = 0
+		self.missed = 0
+		self.dropped = 0
+		self.start_time = None
+		self.stop_time = None
+
+	def start(self):
+		self.start_time = time.time()
+		self.stop_time = None
+
+	def stop(self):
+		self.stop_time = time.time()
+
+	# the slot the next capture is read into
+	def next_slot(self):
+		return self.data[self.count % self.depth]
+
+	def commit(self):
+		self.timestamps[self.count % self.depth] = time.time()
+		self.count += 1
+		return self.count - 1
+
+	# returns the waveforms of a capture, data[channel, point]
+	def capture(self, capture_num):
+		if (capture_num < self.count - self.depth or capture_num >= self.count):
+			raise IndexError("capture " + str(capture_num) + " is no longer in the ring")
+		return self.data[capture_num % self.depth]
+
+	# captures per second
+	def rate(self):
+		if (self.start_time is None):
+			return 0.0
+		elapsed = (self.stop_time or time.time()) - self.start_time
+		if (elapsed <= 0):
+			return 0.0
+		return self.count / elapsed
+
+# writes a screen image, converted to the format of the filename extension when that is not .png
+# and with a _thumb copy when thumbnail_size is given, both need PIL. Logs the filename with debug=True
+def save_screen_capture(raw_data, filename, thumbnail_size=None, debug=False):
+	image = None
+	if (not filename.lower().endswith('.png') or thumbnail_size is not None):
+		if (Image is None):
+			raise ImportError("converting or thumbnailing screen captures needs PIL")
+		image = Image.open(io.BytesIO(raw_data.tobytes()))
+	if (filename.lower().endswith('.png')):
+		fid = open(filename, 'wb')
+		fid.write(raw_data)
+		fid.close()
+	else:
+		image.convert('RGB').save(filename)
+	if (thumbnail_size is not None):
+		root, extension = os.path.splitext(filename)
+		image.thumbnail(thumbnail_size)
+		image.convert('RGB').save(root + '_thumb' + extension)
+	if (debug):
+		log.info("Wrote screen capture to filename \"%s\"", filename)
+
+# waveform sinks for stream_waveform_data, each is opened with the total number of points and
+# the waveform preamble, then written one numpy block at a time
+
+# .npy file written through a memmap, load it back with numpy.load(filename, mmap_mode='r')
+class npy_waveform_sink:
+	def __init__(self, filename):
+		self.filename = filename
+
+	def open(self, num_points, preamble):
+		self.array = np.lib.format.open_memmap(self.filename, mode='w+', dtype=np.float32, shape=(num_points,))
+		self.position = 0
+
+	def write(self, block):
+		self.array[self.position:self.position+len(block)] = block
+		self.position += len(block)
+
+	def close(self):
+		self.array.flush()
+		del self.array
+
+	def __str__(self):
+		return '"' + self.filename + '"'
+
+# one value per line, like write_waveform_data
+class csv_waveform_sink:
+	def __init__(self, filename, fmt='%.6g'):
+		self.filename = filename
+		self.fmt = fmt
+
+	def open(self, num_points, preamble):
+		self.fid = open(self.filename, 'w')
+
+	# tofile formats the whole block in C, savetxt would loop over the rows in python
+	def write(self, block):
+		if (len(block)):
+			block.tofile(self.fid, sep='\n', format=self.fmt)
+			self.fid.write('\n')
+
+	def close(self):
+		self.fid.close()
+
+	def __str__(self):
+		return '"' + self.filename + '"'
+
+# appends to a resizable HDF5 dataset, the preamble is stored in the dataset attributes, needs h5py
+class hdf5_waveform_sink:
+	def __init__(self, filename, dataset='waveform'):
+		if (h5py is None):
+			raise ImportError("hdf5_waveform_sink needs h5py")
+		self.filename = filename
+		self.dataset_name = dataset
+
+	def open(self, num_points, preamble):
+		self.h5file = h5py.File(self.filename, 'a')
+		if (self.dataset_name in self.h5file):
+			del self.h5file[self.dataset_name]
+		self.dataset = self.h5file.create_dataset(self.dataset_name, shape=(0,), maxshape=(None,), dtype='f4', chunks=True)
+		for key in preamble:
+			self.dataset.attrs[key] = preamble[key]
+
+	def write(self, block):
+		position = self.dataset.shape[0]
+		self.dataset.resize((position + len(block),))
+		self.dataset[position:] = block
+
+	def close(self):
+		self.h5file.close()
+
+	def __str__(self):
+		return '"' + self.filename + ':' + self.dataset_name + '"'
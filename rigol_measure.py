@@ -0,0 +1,213 @@
+# host side versions of the scope measurements, computed with numpy from waveform arrays
+#
+# compute_measurements works on captures from get_waveform_data, acquire_continuous or files saved
+# earlier, over the whole memory depth instead of the screen points and without any USB traffic:
+#
+#   waveforms = [scope.get_waveform_data(channel=1), scope.get_waveform_data(channel=2)]
+#   x_increment = scope.get_waveform_preamble()['x_increment']
+#   results = compute_measurements(waveforms, x_increment, channels=[1, 2])
+#   results['frequency'][1]
+#
+# the results are keyed like rigol_ds1054z.get_measurements, by measurement name and then by channel
+# (or (source1, source2) for the double measurements). Percentages are ratios like the scope returns
+# them, values that cannot be measured (no edges, no full period) are nan. Time measurements are
+# averaged over every edge or period in the capture, the scope uses the first one on screen
+import numpy as np
+from rigol_ds1054z import rigol_ds1054z
+
+# threshold upper, middle and lower limits as a fraction of the amplitude, the scope defaults
+default_thresholds = (0.9, 0.5, 0.1)
+
+# number of histogram bins used to find the flat top and base of the waveforms
+histogram_bins = 256
+
+# samples binned at once by top_and_base
+histogram_block = 1 << 20
+
+# returns the index of every sample where x crosses level between it and the next one
+def level_crossings(x, level, rising=True):
+	if (rising):
+		return np.flatnonzero((x[:-1] < level) & (x[1:] >= level))
+	return np.flatnonzero((x[:-1] > level) & (x[1:] <= level))
+
+# fractional sample position where x crosses level between samples index and index+1
+def interpolate_crossings(x, index, level):
+	return index + (level - x[index]) / (x[index+1] - x[index])
+
+# finds the edges that go all the way from below lower to above upper (or back), ignoring noise
+# that stays between the thresholds. returns, for each edge, the last sample on the old side,
+# the first sample on the new side and whether it is a rising edge
+def find_edges(x, lower, upper):
+	state = np.zeros(len(x), dtype=np.int8)
+	state[x >= upper] = 1
+	state[x <= lower] = -1
+	settled = np.flatnonzero(state)
+	settled_state = state[settled]
+	change = np.flatnonzero(settled_state[1:] != settled_state[:-1])
+	return settled[change], settled[change+1], settled_state[change+1] > 0
+
+# flat top and base of each row, the most common value above and below the middle, clamped to
+# [minimum, maximum]. A flat row has top = base = its value. The histogram is filled a block of
+# histogram_block samples at a time, so the temporaries do not grow with the memory depth
+def top_and_base(waveforms, maximum, minimum):
+	top = maximum.copy()
+	base = minimum.copy()
+	half = histogram_bins // 2
+	num_points = waveforms.shape[1]
+	scaled = np.empty(min(num_points, histogram_block), dtype=np.float32)
+	for row in range(waveforms.shape[0]):
+		span = maximum[row] - minimum[row]
+		if (not span > 0):
+			continue
+		counts = np.zeros(histogram_bins, dtype=np.int64)
+		for start in range(0, num_points, histogram_block):
+			block = waveforms[row, start:start+histogram_block]
+			out = scaled[:len(block)]
+			np.subtract(block, minimum[row], out=out, casting='unsafe')
+			np.multiply(out, (histogram_bins - 1) / span, out=out, casting='unsafe')
+			np.clip(out, 0, histogram_bins - 1, out=out)
+			counts += np.bincount(out.astype(np.uint8), minlength=histogram_bins)
+		top[row] = minimum[row] + (half + np.argmax(counts[half:])) * span / (histogram_bins - 1)
+		base[row] = minimum[row] + np.argmax(counts[:half]) * span / (histogram_bins - 1)
+	return np.clip(top, minimum, maximum), np.clip(base, minimum, maximum)
+
+def mean_or_nan(values):
+	if (len(values) == 0):
+		return np.nan
+	return float(np.mean(values))
+
+# the edge and period measurements of one channel, keyed by measurement command
+def edge_measurements(x, x_increment, upper, middle, lower):
+	results = {}
+	before, after, rising = find_edges(x, lower, upper)
+	rise_before, rise_after = before[rising], after[rising]
+	fall_before, fall_after = before[~rising], after[~rising]
+	# middle crossings of each edge, the first one after the edge left the old side
+	mid_up = level_crossings(x, middle, rising=True)
+	mid_down = level_crossings(x, middle, rising=False)
+	rise_mid = interpolate_crossings(x, mid_up[np.searchsorted(mid_up, rise_before)], middle) if len(rise_before) else np.zeros(0)
+	fall_mid = interpolate_crossings(x, mid_down[np.searchsorted(mid_down, fall_before)], middle) if len(fall_before) else np.zeros(0)
+	rise_times = (interpolate_crossings(x, rise_after - 1, upper) - interpolate_crossings(x, rise_before, lower)) * x_increment
+	fall_times = (interpolate_crossings(x, fall_after - 1, lower) - interpolate_crossings(x, fall_before, upper)) * x_increment
+
+	period = mean_or_nan(np.diff(rise_mid)) * x_increment
+	results['PER'] = period
+	results['FREQ'] = 1.0 / period if period > 0 else np.nan
+	results['RTIM'] = mean_or_nan(rise_times)
+	results['FTIM'] = mean_or_nan(fall_times)
+	results['PSLEW'] = float(upper - lower) / results['RTIM'] if results['RTIM'] > 0 else np.nan
+	results['NSLEW'] = float(lower - upper) / results['FTIM'] if results['FTIM'] > 0 else np.nan
+
+	# pulse widths from each middle crossing to the next one of the other polarity
+	next_fall = np.searchsorted(fall_mid, rise_mid)
+	has_fall = next_fall < len(fall_mid)
+	positive_widths = fall_mid[next_fall[has_fall]] - rise_mid[has_fall]
+	next_rise = np.searchsorted(rise_mid, fall_mid)
+	has_rise = next_rise < len(rise_mid)
+	negative_widths = rise_mid[next_rise[has_rise]] - fall_mid[has_rise]
+	results['PWID'] = mean_or_nan(positive_widths) * x_increment
+	results['NWID'] = mean_or_nan(negative_widths) * x_increment
+	results['PDUT'] = results['PWID'] / period if period > 0 else np.nan
+	results['NDUT'] = results['NWID'] / period if period > 0 else np.nan
+	results['PPUL'] = int(np.count_nonzero(has_fall))
+	results['NPUL'] = int(np.count_nonzero(has_rise))
+	results['PEDG'] = int(len(rise_before))
+	results['NEDG'] = int(len(fall_before))
+
+	# whole periods, between the first two and between the first and last rising middle crossings
+	if (len(rise_mid) >= 2):
+		first = int(np.ceil(rise_mid[0]))
+		second = int(np.ceil(rise_mid[1]))
+		last = int(np.ceil(rise_mid[-1]))
+		results['MPAR'] = float(np.sum(x[first:second], dtype=np.float64)) * x_increment
+		results['PVRMS'] = float(np.sqrt(np.mean(np.square(x[first:last], dtype=np.float64))))
+	else:
+		results['MPAR'] = np.nan
+		results['PVRMS'] = np.nan
+	results['rise_mid'] = rise_mid
+	results['fall_mid'] = fall_mid
+	return results
+
+# time from the first edge of source 1 to the nearest edge of source 2, on either side. Negative when
+# the edge of source 1 came after that of source 2, like the scope reports it
+def edge_delay(edges1, edges2, x_increment):
+	if (len(edges1) == 0 or len(edges2) == 0):
+		return np.nan
+	following = np.searchsorted(edges2, edges1[0])
+	neighbours = edges2[max(following - 1, 0):following + 1]
+	nearest = neighbours[np.argmin(np.abs(neighbours - edges1[0]))]
+	return float(nearest - edges1[0]) * x_increment
+
+# waveforms is a 2D array (channel, point), a list of 1D arrays of the same length or a dict of them keyed
+# by channel. channels labels the rows (1, 2, ... by default), x_increment is the sample interval
+# and x_origin the time of the first sample. items defaults to every measurement the scope has,
+# double measurements are done for channel_pairs, by default the first channel paired with each other one
+def compute_measurements(waveforms, x_increment, channels=None, items=None, channel_pairs=None,
+						 x_origin=0.0, thresholds=default_thresholds):
+	if (isinstance(waveforms, dict)):
+		if (channels is None):
+			channels = sorted(waveforms.keys())
+		waveforms = [waveforms[channel] for channel in channels]
+	waveforms = np.atleast_2d(np.asarray(waveforms, dtype=np.float32))
+	if (channels is None):
+		channels = list(range(1, waveforms.shape[0] + 1))
+	if (items is None):
+		items = rigol_ds1054z.single_measurement_list + rigol_ds1054z.double_measurement_list
+	if (channel_pairs is None):
+		channel_pairs = [(channels[0], channel) for channel in channels[1:]]
+	upper_fraction, middle_fraction, lower_fraction = thresholds
+
+	# amplitude measurements, one pass over all channels at once
+	by_command = {}
+	maximum = waveforms.max(axis=1).astype(np.float64)
+	minimum = waveforms.min(axis=1).astype(np.float64)
+	average = waveforms.mean(axis=1, dtype=np.float64)
+	mean_square = np.einsum('ij,ij->i', waveforms, waveforms, dtype=np.float64) / waveforms.shape[1]
+	top, base = top_and_base(waveforms, maximum, minimum)
+	amplitude = top - base
+	valid_amplitude = np.where(amplitude > 0, amplitude, np.nan)
+	by_command['VMAX'] = maximum
+	by_command['VMIN'] = minimum
+	by_command['VPP'] = maximum - minimum
+	by_command['VTOP'] = top
+	by_command['VBAS'] = base
+	by_command['VAMP'] = amplitude
+	by_command['VAVG'] = average
+	by_command['VRMS'] = np.sqrt(mean_square)
+	by_command['VARI'] = mean_square - average * average
+	by_command['VUP'] = base + amplitude * upper_fraction
+	by_command['VMID'] = base + amplitude * middle_fraction
+	by_command['VLOW'] = base + amplitude * lower_fraction
+	by_command['OVER'] = (maximum - top) / valid_amplitude
+	by_command['PRES'] = (base - minimum) / valid_amplitude
+	by_command['TVMAX'] = x_origin + np.argmax(waveforms, axis=1) * x_increment
+	by_command['TVMIN'] = x_origin + np.argmin(waveforms, axis=1) * x_increment
+	by_command['MAR'] = waveforms.sum(axis=1, dtype=np.float64) * x_increment
+
+	# edge and period measurements, each channel vectorized over its samples
+	edges = {}
+	for row in range(len(channels)):
+		edges[channels[row]] = edge_measurements(waveforms[row], x_increment, by_command['VUP'][row],
+												 by_command['VMID'][row], by_command['VLOW'][row])
+
+	results = {}
+	double_commands = [meas_type.command for meas_type in rigol_ds1054z.double_measurement_list]
+	for meas_type in items:
+		readings = {}
+		if (meas_type.command in double_commands):
+			for source1, source2 in channel_pairs:
+				if (meas_type.command in ('RDEL', 'RPH')):
+					delay = edge_delay(edges[source1]['rise_mid'], edges[source2]['rise_mid'], x_increment)
+				else:
+					delay = edge_delay(edges[source1]['fall_mid'], edges[source2]['fall_mid'], x_increment)
+				if (meas_type.command in ('RPH', 'FPH')):
+					delay = delay / edges[source1]['PER'] * 360.0
+				readings[(source1, source2)] = delay
+		else:
+			for row in range(len(channels)):
+				if (meas_type.command in by_command):
+					readings[channels[row]] = float(by_command[meas_type.command][row])
+				else:
+					readings[channels[row]] = edges[channels[row]][meas_type.command]
+		results[meas_type.name] = readings
+	return results
@@ -0,0 +1,323 @@
+# simulated DS1054Z, to run and benchmark the rigol_ds1054z class without a scope
+#
+#   scope = rigol_ds1054z(transport=simulated_ds1054z(latency=0.001, bandwidth=1e6))
+#
+# it answers the commands the class uses: *IDN?, *OPC?, *RST, :SYST:ERR?, :TRIG:STAT?, :SING, :RUN,
+# :STOP, :TFOR, :MEAS:ITEM? (also several joined with ';'), :WAV:PRE?, :WAV:DATA? (NORM and RAW mode,
+# ASC, BYTE and WORD format, with block headers), :DISP:DATA?, :SYST:SET? and :SYST:SET. Any other
+# setting is stored and returned by its query, :CHANn:PROB also rescales :CHANn:SCAL and :CHANn:OFFS
+# like the scope. After :SING the trigger status goes WAIT, TD and then STOP, one step each time
+# :TRIG:STAT? is read, the new waveforms are there once it is STOP. With instant_trigger=True it
+# triggers and completes the acquisition on :SING, like a fast repetitive signal, and :TRIG:STAT?
+# never shows WAIT or TD.
+#
+# every write and read takes latency seconds plus its size over bandwidth bytes per second, to model
+# the USB link (the defaults are instant). writes, reads (replies), bytes_written and bytes_read
+# count the traffic, reset_counters clears them
+import time
+import numpy as np
+from rigol_ds1054z import rigol_ds1054z
+from rigol_measure import compute_measurements
+
+class simulated_ds1054z:
+	resource_name = 'SIM0::6833::1230::DS1ZSIMULATED::0::INSTR'
+	identity = 'RIGOL TECHNOLOGIES,DS1054Z,DS1ZSIMULATED,00.04.04.SP3'
+	screen_points = 1200
+
+	# signal on each channel: (shape, frequency in Hz, amplitude in volts, offset in volts)
+	signals = {1: ('square', 1e3, 3.3, 0.0),
+			   2: ('sine', 1e3, 1.0, 0.0),
+			   3: ('square', 10e3, 5.0, 0.0),
+			   4: ('sine', 50e3, 0.5, 0.25)}
+
+	# size of the screen images, the payload is filler after the file signature
+	screen_capture_bytes = {'PNG': 60000, 'BMP8': 385078, 'BMP24': 1152054, 'JPEG': 50000, 'TIFF': 1152256}
+	screen_capture_signatures = {'PNG': b'\x89PNG\r\n\x1a\n', 'BMP8': b'BM', 'BMP24': b'BM', 'JPEG': b'\xff\xd8\xff', 'TIFF': b'II*\x00'}
+
+	def __init__(self, latency=0.0, bandwidth=None, instant_trigger=False):
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.instant_trigger = instant_trigger
+		self.reply = None
+		self.reset_counters()
+		self.reset_state()
+
+	def reset_counters(self):
+		self.writes = 0
+		self.reads = 0
+		self.bytes_written = 0
+		self.bytes_read = 0
+
+	def reset_state(self):
+		self.settings = {':ACQ:MDEP': '12000000',
+						 ':TIM:MAIN:SCAL': '1.000000e-03',
+						 ':TIM:MAIN:OFFS': '0.000000e+00',
+						 ':WAV:SOUR': 'CHAN1',
+						 ':WAV:MODE': 'NORM',
+						 ':WAV:FORM': 'BYTE',
+						 ':WAV:STAR': '1',
+						 ':WAV:STOP': str(self.screen_points)}
+		for channel in self.signals:
+			self.settings[':CHAN' + str(channel) + ':DISP'] = '1' if channel <= 2 else '0'
+			self.settings[':CHAN' + str(channel) + ':SCAL'] = '1.000000e+00'
+			self.settings[':CHAN' + str(channel) + ':OFFS'] = '0.000000e+00'
+			self.settings[':CHAN' + str(channel) + ':PROB'] = '10'
+		self.errors = []
+		self.trigger_status = 'RUN'
+		self.next_status = []
+		self.acquisitions = 0
+		self.measurements = None
+
+	def transfer(self, num_bytes):
+		delay = self.latency
+		if (self.bandwidth):
+			delay += float(num_bytes) / self.bandwidth
+		if (delay > 0):
+			time.sleep(delay)
+
+	def close(self):
+		pass
+
+	def write(self, message):
+		self.writes += 1
+		self.bytes_written += len(message) + 1
+		self.transfer(len(message) + 1)
+		replies = []
+		for command in message.strip().split(';'):
+			path, _, value = command.strip().partition(' ')
+			path = path.upper()
+			if (path.endswith('?')):
+				replies.append(self.answer(path[:-1], value.strip()))
+			else:
+				self.command(path, value.strip())
+		if (replies):
+			if (len(replies) == 1):
+				self.reply = replies[0]
+			else:
+				self.reply = b';'.join(replies)
+			self.reply += b'\n'
+
+	def read_raw(self):
+		if (self.reply is None):
+			raise RuntimeError("read_raw without a query")
+		reply = self.reply
+		self.reply = None
+		self.reads += 1
+		self.bytes_read += len(reply)
+		self.transfer(len(reply))
+		return reply
+
+	# a command followed by a definite length block, like :SYST:SET #9000004096<data>
+	def write_raw(self, message):
+		message = bytes(message)
+		self.writes += 1
+		self.bytes_written += len(message)
+		self.transfer(len(message))
+		path, _, block = message.partition(b' ')
+		num_digits = int(block[1:2])
+		length = int(block[2:2+num_digits])
+		self.command(path.decode('ascii').upper(), block[2+num_digits:2+num_digits+length])
+
+	def write_binary_values(self, message, values, datatype='B', is_big_endian=False):
+		data = bytes(bytearray(values))
+		self.write_raw(message.strip().encode('ascii') + b' #9' + ('%09d' % len(data)).encode('ascii') + data)
+
+	def command(self, path, value):
+		if (path == '*RST'):
+			self.reset_state()
+		elif (path == '*CLS'):
+			self.errors = []
+		elif (path == ':SING' and self.instant_trigger):
+			self.acquire()
+			self.trigger_status = 'STOP'
+			self.next_status = []
+		elif (path == ':SING'):
+			self.trigger_status = 'WAIT'
+			self.next_status = ['TD', 'STOP']
+		elif (path == ':TFOR'):
+			self.trigger_status = 'TD'
+			self.next_status = ['STOP']
+		elif (path == ':RUN'):
+			self.trigger_status = 'RUN'
+			self.next_status = []
+		elif (path == ':STOP'):
+			self.trigger_status = 'STOP'
+			self.next_status = []
+		elif (path == ':SYST:SET'):
+			self.load_settings(value)
+		elif (path.endswith(':PROB')):
+			self.change_probe(path[:-len(':PROB')], value)
+		else:
+			self.settings[path] = value
+
+	# like the scope, a new probe ratio keeps the volts on screen and rescales the scale and offset
+	def change_probe(self, channel_path, value):
+		ratio = float(value) / self.setting(channel_path + ':PROB')
+		for path in (channel_path + ':SCAL', channel_path + ':OFFS'):
+			self.settings[path] = '%e' % (self.setting(path) * ratio)
+		self.settings[channel_path + ':PROB'] = value
+
+	def answer(self, path, value):
+		if (path == '*IDN'):
+			return self.identity.encode('ascii')
+		elif (path == '*OPC'):
+			return b'1'
+		elif (path == ':TRIG:STAT'):
+			return self.poll_trigger_status().encode('ascii')
+		elif (path == ':SYST:ERR'):
+			if (self.errors):
+				return self.errors.pop(0).encode('ascii')
+			return b'0,"No error"'
+		elif (path == ':WAV:PRE'):
+			return self.preamble().encode('ascii')
+		elif (path == ':WAV:DATA'):
+			return self.waveform_data()
+		elif (path == ':DISP:DATA'):
+			return self.screen_capture(value.split(',')[-1].upper() if value else 'BMP24')
+		elif (path == ':SYST:SET'):
+			return self.block(self.save_settings())
+		elif (path == ':MEAS:ITEM'):
+			return self.measurement(value)
+		return self.settings.get(path, '0').encode('ascii')
+
+	def block(self, data):
+		return b'#9' + ('%09d' % len(data)).encode('ascii') + data
+
+	def setting(self, path):
+		return float(self.settings.get(path, '0'))
+
+	# a single acquisition goes WAIT, TD, STOP, one step each time the status is read
+	def poll_trigger_status(self):
+		status = self.trigger_status
+		if (self.next_status):
+			self.trigger_status = self.next_status.pop(0)
+			if (self.trigger_status == 'STOP'):
+				self.acquire()
+		return status
+
+	def acquire(self):
+		self.acquisitions += 1
+		self.measurements = None
+
+	def waveform_channel(self):
+		return int(self.settings[':WAV:SOUR'][-1])
+
+	def raw_mode(self):
+		return self.settings[':WAV:MODE'].upper().startswith('RAW')
+
+	def num_points(self):
+		if (self.raw_mode()):
+			return int(self.setting(':ACQ:MDEP'))
+		return self.screen_points
+
+	# the scope stores 8 bit samples, 25 codes per division with code 127 in the middle of the screen
+	def y_scaling(self, channel):
+		y_increment = self.setting(':CHAN' + str(channel) + ':SCAL') / 25.0
+		y_origin = int(round(self.setting(':CHAN' + str(channel) + ':OFFS') / y_increment))
+		return y_increment, y_origin, 127
+
+	def x_increment(self):
+		return 12.0 * self.setting(':TIM:MAIN:SCAL') / self.num_points()
+
+	def preamble(self):
+		formats = {'BYTE': 0, 'WORD': 1, 'ASC': 2}
+		y_increment, y_origin, y_reference = self.y_scaling(self.waveform_channel())
+		x_origin = -6.0 * self.setting(':TIM:MAIN:SCAL') + self.setting(':TIM:MAIN:OFFS')
+		return '%d,%d,%d,1,%e,%e,0,%e,%d,%d' % (formats.get(self.settings[':WAV:FORM'].upper(), 0), 2 if self.raw_mode() else 0,
+												 self.num_points(), self.x_increment(), x_origin, y_increment, y_origin, y_reference)
+
+	# samples start to stop (0-based, exclusive) of the last acquisition, generated on demand
+	# so the simulator does not hold the acquisition memory
+	def samples(self, channel, start, stop):
+		shape, frequency, amplitude, offset = self.signals[channel]
+		t = np.arange(start, stop, dtype=np.float64) * self.x_increment() + self.acquisitions * 1.234e-6
+		cycles = (t * frequency) % 1.0
+		if (shape == 'square'):
+			volts = np.where(cycles < 0.5, amplitude, 0.0)
+		else:
+			volts = amplitude * np.sin(2 * np.pi * cycles)
+		volts += offset
+		y_increment, y_origin, y_reference = self.y_scaling(channel)
+		return np.clip(np.round(volts / y_increment) + y_origin + y_reference, 0, 255).astype(np.uint8)
+
+	def waveform_data(self):
+		data_format = self.settings[':WAV:FORM'].upper()
+		limits = rigol_ds1054z.waveform_chunk_points
+		num_points = self.num_points()
+		start = int(self.setting(':WAV:STAR')) - 1
+		stop = min(int(self.setting(':WAV:STOP')), num_points)
+		if (self.raw_mode() and self.trigger_status != 'STOP'):
+			self.errors.append('-221,"Settings conflict"')
+			return self.block(b'')
+		if (stop - start > limits.get(data_format, limits['BYTE'])):
+			self.errors.append('-222,"Data out of range"')
+			stop = start + limits.get(data_format, limits['BYTE'])
+		channel = self.waveform_channel()
+		raw = self.samples(channel, start, stop)
+		if (data_format == 'WORD'):
+			data = raw.astype('<u2').tobytes()
+		elif (data_format == 'ASC'):
+			y_increment, y_origin, y_reference = self.y_scaling(channel)
+			volts = (raw.astype(np.float64) - y_origin - y_reference) * y_increment
+			data = ','.join(['%e' % volt for volt in volts]).encode('ascii')
+		else:
+			data = raw.tobytes()
+		return self.block(data)
+
+	def screen_capture(self, image_format):
+		size = self.screen_capture_bytes.get(image_format, self.screen_capture_bytes['BMP24'])
+		signature = self.screen_capture_signatures.get(image_format, b'BM')
+		return self.block(signature + b'\x00' * (size - len(signature)))
+
+	# the settings file is the sorted settings, one per line, so equal settings give equal files
+	def save_settings(self):
+		lines = [path + ' ' + self.settings[path] for path in sorted(self.settings)]
+		return ('\n'.join(lines) + '\n').encode('ascii')
+
+	def load_settings(self, data):
+		settings = {}
+		for line in bytes(data).decode('ascii').splitlines():
+			path, _, value = line.partition(' ')
+			if (path):
+				settings[path] = value
+		if (':ACQ:MDEP' not in settings):
+			self.errors.append('-224,"Illegal parameter value"')
+			return
+		self.settings = settings
+		self.measurements = None
+
+	# :MEAS:ITEM? VMAX,CHAN1 or RDEL,CHAN1,CHAN2, measured on the screen points like the scope does
+	def measurement(self, value):
+		fields = value.upper().split(',')
+		command = fields[0]
+		sources = tuple(int(field[-1]) for field in fields[1:])
+		if (self.measurements is None):
+			channels = sorted(self.signals)
+			x_increment = 12.0 * self.setting(':TIM:MAIN:SCAL') / self.screen_points
+			waveforms = []
+			for channel in channels:
+				y_increment, y_origin, y_reference = self.y_scaling(channel)
+				raw = self.screen_samples(channel)
+				waveforms.append((raw.astype(np.float64) - y_origin - y_reference) * y_increment)
+			pairs = [(first, second) for first in channels for second in channels if first != second]
+			self.measurements = compute_measurements(waveforms, x_increment, channels=channels, channel_pairs=pairs)
+		names = dict([(meas_type.command, meas_type.name) for meas_type in
+					  rigol_ds1054z.single_measurement_list + rigol_ds1054z.double_measurement_list])
+		if (command not in names):
+			self.errors.append('-113,"Undefined header"')
+			return b'9.9E37'
+		if (len(sources) == 1):
+			reading = self.measurements[names[command]].get(sources[0])
+		else:
+			reading = self.measurements[names[command]].get(sources)
+		if (reading is None or np.isnan(reading)):
+			return b'9.9E37'
+		return ('%e' % reading).encode('ascii')
+
+	# the screen shows the acquisition at screen_points resolution
+	def screen_samples(self, channel):
+		mode = self.settings[':WAV:MODE']
+		self.settings[':WAV:MODE'] = 'NORM'
+		raw = self.samples(channel, 0, self.screen_points)
+		self.settings[':WAV:MODE'] = mode
+		return raw
@@ -1,5 +1,5 @@
 from rigol_ds1054z import rigol_ds1054z
-import time
+import logging
 import smbus
 
 # rigol_ds1054z class functions were writen to allow the high-level script
@@ -9,7 +9,8 @@ import smbus
 #  to demonstrate triggering on SDA data (you don't need a slave device,
 #  the scope is just observing the master write out to the bus)
 
-scope = rigol_ds1054z()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+scope = rigol_ds1054z(debug=True)
 scope.print_info()
 scope.reset()
 scope.setup_channel(channel=1,on=1,offset_divs=2.0, volts_per_div=2.0)
@@ -21,11 +22,9 @@ scope.setup_i2c_decode(sda_channel=1, scl_channel=2)
 scope.single_trigger()
 i2c = smbus.SMBus(1)
 i2c.write_quick(0x50) #
-time.sleep(3)
-for measurement in scope.single_measurement_list:
-	scope.get_measurement(channel=1, meas_type=measurement)
-for measurement in scope.single_measurement_list:
-	scope.get_measurement(channel=2, meas_type=measurement)
+scope.wait_for_trigger(timeout=3)
+scope.wait_for_acquisition(timeout=3)
+scope.get_measurements(channels=[1, 2], items=scope.single_measurement_list + scope.double_measurement_list)
 scope.get_measurement(channel=1, meas_type=scope.max_voltage)
 scope.write_screen_capture(filename='rigol_i2c_no_slave.png')
 scope.write_waveform_data(channel=1)
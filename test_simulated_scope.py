@@ -0,0 +1,401 @@
+# tests of the rigol_ds1054z class against the simulated scope in rigol_sim.py, no scope needed:
+#
+#   python -m pytest -q
+#
+# test_rigol.py is the demo script for a real scope, conftest.py keeps pytest from collecting it
+import logging
+import threading
+import time
+import numpy as np
+import pytest
+from rigol_ds1054z import rigol_ds1054z, instrumentation, preset_store, rigol_scope_error, rigol_timeout_error
+import rigol_ds1054z as rigol_ds1054z_module
+from rigol_ds1054z import npy_waveform_sink, csv_waveform_sink, hdf5_waveform_sink
+from rigol_measure import compute_measurements
+from rigol_sim import simulated_ds1054z
+try:
+	import asyncio
+	import rigol_async
+except (ImportError, SyntaxError):
+	rigol_async = None
+
+@pytest.fixture
+def sim():
+	return simulated_ds1054z()
+
+@pytest.fixture
+def scope(sim):
+	scope = rigol_ds1054z(transport=sim)
+	yield scope
+	scope.close()
+
+# a transport that answers every read with the same reply
+class canned_transport:
+	def __init__(self, reply):
+		self.reply = reply
+
+	def write(self, message):
+		pass
+
+	def read_raw(self):
+		return self.reply
+
+	def close(self):
+		pass
+
+def test_cache_skips_unchanged_settings(scope, sim):
+	scope.setup_channel(channel=1, on=1, offset_divs=2.0, volts_per_div=2.0)
+	writes = sim.writes
+	scope.setup_channel(channel=1, on=1, offset_divs=2.0, volts_per_div=2.0)
+	assert sim.writes == writes
+	assert scope.cache_stats()['hits'] > 0
+	scope.setup_channel(channel=1, on=1, offset_divs=2.0, volts_per_div=1.0)
+	assert sim.writes > writes
+
+def test_cache_follows_probe_change(scope, sim):
+	scope.setup_channel(channel=1, on=1, offset_divs=1.0, volts_per_div=2.0, probe=10.0)
+	scope.setup_channel(channel=1, on=1, offset_divs=1.0, volts_per_div=2.0, probe=1.0)
+	assert float(sim.settings[':CHAN1:SCAL']) == 2.0
+	assert float(sim.settings[':CHAN1:OFFS']) == 2.0
+	writes = sim.writes
+	scope.setup_channel(channel=1, on=1, offset_divs=1.0, volts_per_div=2.0, probe=1.0)
+	assert sim.writes == writes
+
+def test_cache_same_value():
+	scope = rigol_ds1054z(transport=canned_transport(b''))
+	assert scope.same_value('ON', '1')
+	assert scope.same_value('off', '0')
+	assert scope.same_value('2.000000e+00', '2.0')
+	assert not scope.same_value('CHAN1', 'CHAN2')
+
+def test_cache_invalidated_by_reset(scope, sim):
+	scope.set_value(':CHAN1:SCAL', 2.0)
+	scope.reset()
+	assert scope.cache_stats()['entries'] == 0
+	writes = sim.writes
+	scope.set_value(':CHAN1:SCAL', 2.0)
+	assert sim.writes == writes + 1
+
+def test_get_value_queries_once(scope, sim):
+	sim.settings[':CHAN1:SCAL'] = '5.000000e-01'
+	assert scope.get_value(':CHAN1:SCAL') == '5.000000e-01'
+	reads = sim.reads
+	assert scope.get_value(':CHAN1:SCAL') == '5.000000e-01'
+	assert sim.reads == reads
+
+def test_read_tmc_block():
+	scope = rigol_ds1054z(transport=canned_transport(b'#9000000005hello\n'))
+	assert scope.read_tmc_block().tobytes() == b'hello'
+	scope = rigol_ds1054z(transport=canned_transport(b'#15abcdefgh'))
+	assert scope.read_tmc_block().tobytes() == b'abcde'
+
+def test_read_tmc_block_rejects_other_replies():
+	scope = rigol_ds1054z(transport=canned_transport(b'1.0\n'))
+	with pytest.raises(ValueError):
+		scope.read_tmc_block()
+
+def test_presets(scope, sim, tmpdir):
+	store = preset_store(str(tmpdir))
+	scope.setup_channel(channel=1, on=1, offset_divs=0.0, volts_per_div=1.0)
+	scope.save_preset('one_volt', store)
+	scope.setup_channel(channel=1, on=1, offset_divs=0.0, volts_per_div=2.0)
+	scope.save_preset('two_volts', store)
+	assert scope.load_preset('two_volts', store) == 'unchanged'
+	assert scope.load_preset('one_volt', store) == 'partial'
+	assert sim.settings[':CHAN1:SCAL'] == '1.0'
+	assert scope.load_preset('two_volts', store, allow_partial=False) == 'full'
+	assert sim.settings[':CHAN1:SCAL'] == '2.0'
+	assert sorted(preset_store(str(tmpdir)).names()) == ['one_volt', 'two_volts']
+
+def test_rejected_preset_raises(scope, tmpdir):
+	store = preset_store(str(tmpdir))
+	scope.setup_channel(channel=1, on=1, offset_divs=0.0, volts_per_div=1.0)
+	store.save('broken', b':CHAN1:SCAL 5.0\n')
+	with pytest.raises(rigol_scope_error) as error:
+		scope.load_preset('broken', store)
+	assert error.value.errors[0].startswith(b'-224')
+	assert scope.cache_stats()['entries'] == 0
+
+def test_full_preset_load_leaves_cache_empty(scope, tmpdir):
+	store = preset_store(str(tmpdir))
+	scope.setup_channel(channel=1, on=1, offset_divs=0.0, volts_per_div=1.0)
+	scope.save_preset('one_volt', store)
+	scope.setup_channel(channel=1, on=1, offset_divs=0.0, volts_per_div=2.0)
+	assert scope.load_preset('one_volt', store, allow_partial=False) == 'full'
+	assert scope.cache_stats()['entries'] == 0
+	assert scope.get_value(':CHAN1:SCAL') == '1.0'
+
+def test_single_trigger_waits_for_the_new_acquisition(scope, sim):
+	scope.setup_mem_depth(6e3)
+	acquisitions = sim.acquisitions
+	scope.single_trigger()
+	assert sim.trigger_status != 'STOP'
+	assert scope.wait_for_trigger() in (b'TD', b'STOP')
+	scope.wait_for_acquisition()
+	assert sim.acquisitions == acquisitions + 1
+	scope.get_waveform_data(channel=1)
+	assert scope.check_errors() == []
+
+def test_single_trigger_instant_acquisition():
+	sim = simulated_ds1054z(instant_trigger=True)
+	scope = rigol_ds1054z(transport=sim)
+	scope.setup_mem_depth(6e3)
+	scope.single_trigger(timeout=0.5)
+	scope.wait_for_acquisition(timeout=0.5)
+	assert sim.acquisitions == 1
+	scope.get_waveform_data(channel=1)
+	assert scope.check_errors() == []
+
+# answers the first query late: the read times out and each later read returns the reply before
+# its own, unless the session is cleared in between
+class late_transport(simulated_ds1054z):
+	def __init__(self):
+		simulated_ds1054z.__init__(self)
+		self.late_replies = []
+		self.timed_out = False
+		self.clears = 0
+
+	def read_raw(self):
+		reply = simulated_ds1054z.read_raw(self)
+		if (not self.timed_out):
+			self.timed_out = True
+			self.late_replies.append(reply)
+			raise IOError("timeout")
+		if (self.late_replies):
+			self.late_replies.append(reply)
+			return self.late_replies.pop(0)
+		return reply
+
+	def clear(self):
+		self.clears += 1
+		self.late_replies = []
+
+def test_poll_clears_the_session_after_a_timeout(monkeypatch):
+	monkeypatch.setattr(rigol_ds1054z_module, 'transport_timeout_errors', (IOError,))
+	sim = late_transport()
+	scope = rigol_ds1054z(transport=sim)
+	sim.settings[':ACQ:MDEP'] = '6000'
+	scope.wait_for_complete()
+	assert sim.clears == 1
+	assert scope.query(':ACQ:MDEP?') == b'6000'
+
+def test_wait_for_acquisition_times_out_while_running(scope):
+	scope.run_trigger()
+	with pytest.raises(rigol_timeout_error):
+		scope.wait_for_acquisition(timeout=0.05)
+
+def test_acquire_continuous_raw(scope, sim):
+	scope.setup_mem_depth(6e3)
+	ring = scope.acquire_continuous(channels=[1, 2], num_captures=3, depth=2, mode='RAW')
+	assert ring.count == 3
+	assert ring.missed == 0
+	assert sim.acquisitions == 3
+	assert scope.check_errors() == []
+
+def test_acquire_continuous_instant_trigger():
+	sim = simulated_ds1054z(instant_trigger=True)
+	scope = rigol_ds1054z(transport=sim)
+	scope.setup_mem_depth(6e3)
+	start = time.time()
+	ring = scope.acquire_continuous(channels=[1], num_captures=5, mode='RAW', trigger_timeout=0.1)
+	assert time.time() - start < 2.0
+	assert ring.count == 5
+	assert ring.missed == 0
+	assert sim.acquisitions == 5
+	assert scope.check_errors() == []
+
+def test_get_waveform_data_scaling(scope, sim):
+	scope.setup_mem_depth(6e3)
+	scope.single_trigger()
+	scope.wait_for_acquisition()
+	waveform = scope.get_waveform_data(channel=1)
+	assert len(waveform) == 6000
+	assert abs(waveform.max() - 3.3) < 0.1
+	assert abs(waveform.min()) < 0.1
+
+def test_write_waveform_data_after_get_waveform_data(scope, tmpdir):
+	scope.setup_mem_depth(6e4)
+	scope.single_trigger()
+	scope.wait_for_acquisition()
+	waveform = scope.get_waveform_data(channel=1)
+	filename = str(tmpdir.join('channel1.csv'))
+	scope.write_waveform_data(channel=1, filename=filename)
+	written = np.loadtxt(filename)
+	assert len(written) == 60000
+	assert np.allclose(written, waveform, atol=1e-4)
+
+# a 6e5 point capture, read in three chunks, and the same memory read in one go
+@pytest.fixture
+def captured(scope):
+	scope.setup_mem_depth(6e5)
+	scope.single_trigger()
+	scope.wait_for_acquisition()
+	return scope.get_waveform_data(channel=1)
+
+def test_iter_waveform_chunks(scope, captured):
+	chunks = list(scope.iter_waveform_chunks(channel=1))
+	assert [len(chunk) for chunk in chunks] == [250000, 250000, 100000]
+	assert np.array_equal(np.concatenate(chunks), captured)
+
+def test_npy_waveform_sink(scope, captured, tmpdir):
+	filename = str(tmpdir.join('waveform.npy'))
+	scope.stream_waveform_data(npy_waveform_sink(filename), channel=1)
+	assert np.array_equal(np.load(filename), captured)
+
+def test_csv_waveform_sink(scope, captured, tmpdir):
+	filename = str(tmpdir.join('waveform.csv'))
+	scope.stream_waveform_data(csv_waveform_sink(filename), channel=1)
+	assert np.allclose(np.loadtxt(filename), captured, atol=1e-4)
+
+def test_hdf5_waveform_sink(scope, captured, tmpdir):
+	h5py = pytest.importorskip('h5py')
+	filename = str(tmpdir.join('waveform.h5'))
+	scope.stream_waveform_data(hdf5_waveform_sink(filename), channel=1)
+	with h5py.File(filename, 'r') as h5file:
+		assert np.array_equal(h5file['waveform'][:], captured)
+
+def test_stream_waveform_data_sink_open_fails(scope, tmpdir):
+	threads = threading.active_count()
+	with pytest.raises(IOError):
+		scope.stream_waveform_data(csv_waveform_sink(str(tmpdir.join('missing', 'waveform.csv'))), channel=1)
+	assert threading.active_count() == threads
+
+def test_get_measurements_matches_get_measurement(scope):
+	items = [scope.max_voltage, scope.min_voltage, scope.top_voltage, scope.frequency]
+	results = scope.get_measurements(channels=[1, 2], items=items)
+	for meas_type in items:
+		for channel in [1, 2]:
+			single = scope.get_measurement(channel=channel, meas_type=meas_type)
+			assert results[meas_type.name][channel] == pytest.approx(single)
+
+def test_double_measurements_need_pairs(scope):
+	with pytest.raises(ValueError):
+		scope.get_measurements(channels=[1], items=scope.double_measurement_list)
+
+def test_compute_measurements_square_wave():
+	period = 1000
+	samples = np.arange(20 * period)
+	square = np.where(samples % period < period // 2, 3.3, 0.0)
+	results = compute_measurements([square], 1e-6)
+	assert results['top_voltage'][1] == pytest.approx(3.3, abs=0.02)
+	assert results['base_voltage'][1] == pytest.approx(0.0, abs=0.02)
+	assert results['frequency'][1] == pytest.approx(1e3, rel=1e-3)
+	assert results['positive_duty_ratio'][1] == pytest.approx(0.5, abs=0.01)
+
+@pytest.mark.parametrize('shift', [10, -10])
+def test_compute_measurements_delay_and_phase(shift):
+	period = 1000
+	samples = np.arange(20 * period)
+	source1 = np.where((samples + 50) % period < period // 2, 3.3, 0.0)
+	source2 = np.where((samples + 50 + shift) % period < period // 2, 3.3, 0.0)
+	results = compute_measurements([source1, source2], 1e-6)
+	delay = -shift * 1e-6
+	assert results['rising_delay_time'][(1, 2)] == pytest.approx(delay, abs=1e-7)
+	assert results['falling_delay_time'][(1, 2)] == pytest.approx(delay, abs=1e-7)
+	assert results['rising_phase_ratio'][(1, 2)] == pytest.approx(delay * 1e3 * 360.0, abs=0.01)
+	assert results['falling_phase_ratio'][(1, 2)] == pytest.approx(delay * 1e3 * 360.0, abs=0.01)
+
+def test_compute_measurements_flat_trace():
+	results = compute_measurements(np.full((1, 1000), 1.0), 1e-6)
+	assert results['top_voltage'][1] == pytest.approx(1.0)
+	assert results['base_voltage'][1] == pytest.approx(1.0)
+	assert results['top_to_base_voltage'][1] == 0.0
+	assert np.isnan(results['overshoot_percent'][1])
+	assert np.isnan(results['preshoot_percent'][1])
+
+def test_compute_measurements_top_and_base_within_range():
+	noisy = np.random.RandomState(0).normal(0.0, 0.1, (3, 5000))
+	results = compute_measurements(noisy, 1e-6)
+	for channel in [1, 2, 3]:
+		assert results['min_voltage'][channel] <= results['base_voltage'][channel]
+		assert results['top_voltage'][channel] <= results['max_voltage'][channel]
+
+def test_instrumentation_method_stack_per_thread():
+	recorded = instrumentation()
+	entered = threading.Event()
+	release = threading.Event()
+	def slow():
+		entered.set()
+		release.wait(5)
+	def fast():
+		pass
+	slow = recorded.wrap_method('slow', slow)
+	fast = recorded.wrap_method('fast', fast)
+	thread = threading.Thread(target=slow)
+	thread.start()
+	entered.wait(5)
+	fast()
+	release.set()
+	thread.join()
+	assert ('fast', 'method') in recorded.histograms
+	assert ('fast', 'call') not in recorded.histograms
+	assert ('slow', 'method') in recorded.histograms
+
+def test_screen_capture_logs_only_with_debug(sim, tmpdir, caplog):
+	caplog.set_level(logging.INFO, logger='rigol_ds1054z')
+	scope = rigol_ds1054z(transport=sim)
+	scope.write_screen_capture(filename=str(tmpdir.join('quiet.png')))
+	scope.write_screen_capture(filename=str(tmpdir.join('background.png')), background=True)
+	scope.close()
+	assert caplog.records == []
+	scope = rigol_ds1054z(debug=True, transport=sim)
+	scope.write_screen_capture(filename=str(tmpdir.join('debug.png')))
+	assert 'debug.png' in caplog.text
+
+# counts the transfers in flight at once over all instances
+class concurrent_transport(simulated_ds1054z):
+	lock = threading.Lock()
+	in_flight = 0
+	max_in_flight = 0
+
+	def transfer(self, num_bytes):
+		with self.lock:
+			concurrent_transport.in_flight += 1
+			concurrent_transport.max_in_flight = max(concurrent_transport.max_in_flight, concurrent_transport.in_flight)
+		try:
+			simulated_ds1054z.transfer(self, num_bytes)
+		finally:
+			with self.lock:
+				concurrent_transport.in_flight -= 1
+
+@pytest.mark.skipif(rigol_async is None, reason='rigol_async needs python 3')
+def test_async_calls_overlap():
+	concurrent_transport.max_in_flight = 0
+	loop = asyncio.new_event_loop()
+	try:
+		scopes = [loop.run_until_complete(rigol_async.async_rigol_ds1054z.open(transport=concurrent_transport(latency=0.05)))
+				  for scope_num in range(3)]
+		pool = rigol_async.scope_pool(scopes)
+		assert loop.run_until_complete(pool.call('print_info')) == [simulated_ds1054z.identity] * 3
+		loop.run_until_complete(pool.close())
+	finally:
+		loop.close()
+	assert concurrent_transport.max_in_flight == 3
+
+@pytest.mark.skipif(rigol_async is None, reason='rigol_async needs python 3')
+def test_async_pool_open_closes_scopes_after_a_failure(monkeypatch):
+	resources = ['USB0::6833::1230::DS1ZA0000000' + str(num) + '::0::INSTR' for num in range(3)]
+	closed = []
+	class closing_transport(simulated_ds1054z):
+		def close(self):
+			closed.append(self.resource_name)
+	def open_scope(resource='', **kwargs):
+		if (resource == resources[1]):
+			raise IOError("cannot open " + resource)
+		transport = closing_transport()
+		transport.resource_name = resource
+		return rigol_ds1054z(transport=transport, **kwargs)
+	monkeypatch.setattr(rigol_async, 'find_rigol_resources', lambda: resources)
+	monkeypatch.setattr(rigol_async, 'rigol_ds1054z', open_scope)
+	loop = asyncio.new_event_loop()
+	try:
+		with pytest.raises(IOError):
+			loop.run_until_complete(rigol_async.scope_pool.open())
+		assert sorted(closed) == [resources[0], resources[2]]
+		with pytest.raises(ValueError):
+			loop.run_until_complete(rigol_async.scope_pool.open(serials=['DS1ZNOTTHERE']))
+		pool = loop.run_until_complete(rigol_async.scope_pool.open(serials=['DS1ZA00000002']))
+		assert pool.serial_numbers() == ['DS1ZA00000002']
+		loop.run_until_complete(pool.close())
+	finally:
+		loop.close()